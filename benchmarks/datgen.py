@@ -0,0 +1,279 @@
+"""Generates synthetic game files in the ScottFree .DAT format.
+
+The games are random but valid: every action, room, item and message
+refers to things that exist, so the engine can load and play them. They
+are meant for benchmarks, not for fun. Run from the repository root:
+
+    python -m benchmarks.datgen OUT.DAT [--rooms N] [--items N] ...
+"""
+
+import argparse
+import random
+
+# Verb and noun numbers are packed into actions as verb * 150 + noun.
+MAX_WORDS = 150
+
+_directions = ["NORTH", "SOUTH", "EAST", "WEST", "UP", "DOWN"]
+
+# condition op -> what its value selects
+_condition_kinds = {
+    **{op: "item" for op in (1, 2, 3, 5, 6, 12, 13, 14, 17, 18)},
+    **{op: "room" for op in (4, 7)},
+    **{op: "flag" for op in (8, 9)},
+    **{op: "none" for op in (10, 11)},
+    **{op: "count" for op in (15, 16, 19)},
+}
+
+# action op -> what its arguments select. Game over, save, wait and
+# graphics are left out, as they would stop or stall a benchmark, and so
+# is printing the noun, which occurances may do before any command.
+_action_kinds = {
+    52: ["item"],
+    53: ["item"],
+    54: ["room"],
+    55: ["item"],
+    56: [],
+    57: [],
+    58: ["flag"],
+    60: ["flag"],
+    62: ["item", "room"],
+    64: [],
+    66: [],
+    69: [],
+    72: ["item", "item"],
+    73: [],
+    74: ["item"],
+    75: ["item", "item"],
+    77: [],
+    78: [],
+    79: ["count"],
+    80: [],
+    81: ["counter"],
+    82: ["count"],
+    83: ["count"],
+    86: [],
+    87: ["counter"],
+}
+
+
+def make_word(prefix, n):
+    """Makes up a vocabulary word, unique in its first four letters."""
+    letters = ""
+    for i in range(3):
+        letters = chr(ord("A") + n % 26) + letters
+        n //= 26
+    return prefix + letters
+
+
+class DatGenerator:
+    """Generates the content of a random game, and writes it out.
+
+    rooms, items, actions, words, messages - how many of each to generate;
+    'words' counts verbs (and nouns, as there are as many of each).
+    """
+
+    def __init__(
+        self, rooms=30, items=40, actions=200, words=60, messages=80, seed=0
+    ):
+        if items < 10:
+            raise ValueError("A game needs at least 10 items; item 9 is the lamp.")
+        if rooms < 3:
+            raise ValueError("A game needs at least 3 rooms.")
+        if not 16 <= words <= MAX_WORDS:
+            raise ValueError(f"A game needs between 16 and {MAX_WORDS} words.")
+
+        self.random = random.Random(seed)
+        self.room_count = rooms
+        self.item_count = items
+        self.action_count = actions
+        self.message_count = max(messages, 2)
+
+        self.verbs = ["AUT", "GO", "*WALK", "GET", "*TAKE", "DROP", "SCORE", "INVENTORY"]
+        self.nouns = ["ANY"] + _directions + ["LAMP"]
+        while len(self.verbs) < words:
+            self.verbs.append(make_word("V", len(self.verbs)))
+        while len(self.nouns) < words:
+            self.nouns.append(make_word("N", len(self.nouns)))
+        self.item_nouns = self.nouns[len(_directions) + 1 :]
+
+    def pick_value(self, kind):
+        """Picks a random value for an opcode argument of the kind given."""
+        rnd = self.random
+        if kind == "item":
+            return rnd.randrange(self.item_count)
+        if kind == "room":
+            return rnd.randrange(1, self.room_count)
+        if kind == "flag":
+            return rnd.randrange(32)
+        if kind == "counter":
+            return rnd.randrange(16)
+        if kind == "count":
+            return rnd.randrange(10)
+        return 0
+
+    def pick_message_op(self):
+        """Picks an action op that prints a message that exists."""
+        message = self.random.randrange(1, min(self.message_count, 100))
+        return message if message <= 51 else message + 50
+
+    def make_action(self, verb, noun):
+        """Makes the numbers for an action: verb and noun, five conditions and
+        four action opcodes. Arguments to the actions share the condition
+        slots, so there can't be too many of either."""
+        rnd = self.random
+        conditions = []
+        for n in range(rnd.randint(0, 3)):
+            op = rnd.choice(list(_condition_kinds))
+            conditions.append(self.pick_value(_condition_kinds[op]) * 20 + op)
+
+        args = []
+        ops = []
+        for n in range(rnd.randint(1, 4)):
+            if rnd.random() < 0.4:
+                ops.append(self.pick_message_op())
+                continue
+            op = rnd.choice(list(_action_kinds))
+            kinds = _action_kinds[op]
+            if len(conditions) + len(args) + len(kinds) <= 5:
+                args += [self.pick_value(kind) for kind in kinds]
+                ops.append(op)
+
+        conditions += [a * 20 for a in args]
+        conditions += [0] * (5 - len(conditions))
+        ops += [0] * (4 - len(ops))
+        return [verb * 150 + noun] + conditions + [ops[0] * 150 + ops[1], ops[2] * 150 + ops[3]]
+
+    def make_actions(self):
+        """Makes a mix of commands, occurances, and continuations following either."""
+        rnd = self.random
+        verbs = [i for i, v in enumerate(self.verbs) if i > 0 and not v.startswith("*")]
+        nouns = [0] + list(range(len(_directions) + 1, len(self.nouns)))
+        actions = []
+        for n in range(self.action_count):
+            kind = rnd.random()
+            if kind < 0.2:
+                actions.append(self.make_action(0, rnd.randint(1, 100)))
+            elif kind < 0.3 and len(actions) > 0:
+                actions.append(self.make_action(0, 0))
+            else:
+                actions.append(self.make_action(rnd.choice(verbs), rnd.choice(nouns)))
+        return actions
+
+    def make_rooms(self):
+        """Makes the rooms, as tuples of six exits and a description. Room 0 is
+        the usual empty placeholder."""
+        rnd = self.random
+        rooms = [(0, 0, 0, 0, 0, 0, "")]
+        for r in range(1, self.room_count):
+            exits = [
+                rnd.randrange(1, self.room_count) if rnd.random() < 0.4 else 0
+                for d in _directions
+            ]
+            noun = rnd.choice(self.item_nouns).lower()
+            verb = rnd.choice(self.verbs[8:]).lower()
+            description = f"room {r} with a {noun} and\nsome {verb} text"
+            rooms.append(tuple(exits) + (description,))
+        return rooms
+
+    def make_items(self):
+        """Makes the items, as tuples of description and starting room; every
+        seventh item is a treasure."""
+        rnd = self.random
+        items = []
+        for i in range(self.item_count):
+            word = "LAMP" if i == 9 else rnd.choice(self.item_nouns)
+            description = f"{word.lower()} thing"
+            if i % 7 == 3:
+                description = "*" + description + "*"
+            if i == 9 or rnd.random() < 0.6:
+                description += f"/{word}/"
+            room = 1 if i == 9 else rnd.randrange(self.room_count)
+            items.append((description, room))
+        return items
+
+    def write(self, file):
+        """Writes the game to a text file."""
+        rnd = self.random
+        actions = self.make_actions()
+        rooms = self.make_rooms()
+        items = self.make_items()
+        messages = [""] + [
+            f"Message {i} mentions the {rnd.choice(self.item_nouns)}."
+            for i in range(1, self.message_count)
+        ]
+        treasures = sum(1 for description, room in items if description.startswith("*"))
+
+        def write_num(n):
+            file.write(f" {n} \n")
+
+        def write_string(text, extra=""):
+            file.write(f'"{text}"{extra}\n')
+
+        header = [
+            0,
+            self.item_count - 1,
+            self.action_count - 1,
+            len(self.verbs) - 1,
+            self.room_count - 1,
+            self.item_count,  # max carried; generous, so random actions rarely fail
+            1,  # starting room
+            treasures,
+            4,  # word length
+            200,  # light duration
+            self.message_count - 1,
+            self.room_count - 1,  # treasure room
+        ]
+        for n in header:
+            write_num(n)
+        for action in actions:
+            for n in action:
+                write_num(n)
+        for verb, noun in zip(self.verbs, self.nouns):
+            write_string(verb)
+            write_string(noun)
+        for room in rooms:
+            for n in room[:6]:
+                write_num(n)
+            write_string(room[6])
+        for message in messages:
+            write_string(message)
+        for description, room in items:
+            write_string(description, f" {room} ")
+        for n in range(self.action_count):
+            write_string(f"action {n}")
+
+        # version, adventure number, and checksum, which we don't use
+        for n in (416, 1, 0):
+            write_num(n)
+
+
+def generate_dat(path, **counts):
+    """Writes a random game to the file at 'path'; see DatGenerator for the
+    counts you can give."""
+    with open(path, "w") as file:
+        DatGenerator(**counts).write(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output")
+    parser.add_argument("--rooms", type=int, default=30)
+    parser.add_argument("--items", type=int, default=40)
+    parser.add_argument("--actions", type=int, default=200)
+    parser.add_argument("--words", type=int, default=60)
+    parser.add_argument("--messages", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate_dat(
+        args.output,
+        rooms=args.rooms,
+        items=args.items,
+        actions=args.actions,
+        words=args.words,
+        messages=args.messages,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Compares cold and warm startup times for a game file.
+
+A cold start parses the .DAT and works out command words; a warm start
+loads the compiled game from the cache. Run from the repository root:
+
+    python -m benchmarks.startup GAME.DAT [--repeat N]
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+
+from cache import load_game
+from game import Game
+
+
+def time_load(path, cache_dir):
+    start = time.perf_counter()
+    load_game(path, Game, cache_dir)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("game_file")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    cold = []
+    warm = []
+    for n in range(args.repeat):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cold.append(time_load(args.game_file, cache_dir))
+            warm.append(time_load(args.game_file, cache_dir))
+
+    cold_ms = statistics.median(cold) * 1000
+    warm_ms = statistics.median(warm) * 1000
+    print(f"cold start: {cold_ms:.2f} ms (median of {args.repeat})")
+    print(f"warm start: {warm_ms:.2f} ms (median of {args.repeat})")
+    print(f"speedup:    {cold_ms / warm_ms:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Runs the engine benchmarks on generated games, and writes the results as JSON.
+
+Each benchmark times one part of the engine: parsing the .DAT, building
+the Game, running occurances, running commands, building the room
+description, and working out the commands a word offers, afresh and
+from the cache. Timings are per
+call, in microseconds. Run from the repository root:
+
+    python -m benchmarks.suite [--size NAME ...] [--output FILE] [--repeat N]
+
+Keep the JSON from each release, and compare them to spot regressions.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.datgen import generate_dat
+from execution import Command
+from extraction import ExtractedFile, load_extracted
+from game import Game, WordError
+
+# The games the suite generates, by name: the counts given to datgen.
+SIZES = {
+    "small": dict(rooms=30, items=40, actions=200, words=60, messages=80),
+    "large": dict(rooms=300, items=400, actions=3000, words=140, messages=800),
+}
+
+# Bump this when the benchmarks change, so old results aren't compared
+# with new ones.
+SUITE_VERSION = 2
+
+
+def time_calls(function, calls, repeat):
+    """Calls 'function' 'calls' times, 'repeat' times over; returns the time
+    per call of each repetition, in seconds."""
+    timings = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        for n in range(calls):
+            function()
+        timings.append((time.perf_counter() - start) / calls)
+    return timings
+
+
+async def time_async_calls(function, calls, repeat):
+    """Like time_calls, but awaits each call of the coroutine function."""
+    timings = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        for n in range(calls):
+            await function()
+        timings.append((time.perf_counter() - start) / calls)
+    return timings
+
+
+def summarize(timings, calls):
+    """Returns the JSON record for a benchmark's timings."""
+    return {
+        "calls": calls,
+        "repeat": len(timings),
+        "min_us": round(min(timings) * 1e6, 3),
+        "median_us": round(statistics.median(timings) * 1e6, 3),
+    }
+
+
+def get_sample_commands(game):
+    """Returns the (verb, noun) pairs the command benchmark plays: every command
+    the game defines, plus moves in each direction and getting and dropping
+    each item."""
+    texts = [
+        f"{cmd.verb} {cmd.noun or ''}" for cmd in game.commands if isinstance(cmd, Command)
+    ]
+    texts += ["GO " + direction for direction in ("N", "S", "E", "W", "U", "D")]
+    for item in game.items:
+        if item.carry_word is not None:
+            texts += ["GET " + str(item.carry_word), "DROP " + str(item.carry_word)]
+
+    commands = []
+    for text in texts:
+        try:
+            commands.append(game.parse_command(text))
+        except ValueError:
+            pass
+    return commands
+
+
+def make_game(extracted, seed):
+    """Builds a game, seeding the random numbers its occurances use."""
+    random.seed(seed)
+    return Game(extracted)
+
+
+def run_benchmarks(path, repeat, seed):
+    """Runs every benchmark on the game file at 'path'; returns a dict of
+    results by benchmark name."""
+    results = {}
+    with open(path, "r") as file:
+        text = file.read()
+
+    calls = 5
+    timings = time_calls(lambda: ExtractedFile(io.StringIO(text)), calls, repeat)
+    results["extract_text"] = summarize(timings, calls)
+    timings = time_calls(lambda: load_extracted(path), calls, repeat)
+    results["extract_dat"] = summarize(timings, calls)
+
+    extracted = load_extracted(path)
+    timings = time_calls(lambda: make_game(extracted, seed), calls, repeat)
+    results["game_init"] = summarize(timings, calls)
+
+    async def perform_occurances():
+        try:
+            await game.perform_occurances()
+        except ValueError:
+            pass
+        game.extract_output()
+
+    calls = 200
+    game = make_game(extracted, seed)
+    timings = asyncio.run(time_async_calls(perform_occurances, calls, repeat))
+    results["perform_occurances"] = summarize(timings, calls)
+
+    game = make_game(extracted, seed)
+    commands = get_sample_commands(game)
+    rnd = random.Random(seed)
+
+    async def perform_command():
+        verb, noun = rnd.choice(commands)
+        try:
+            await game.perform_command(verb, noun)
+        except (ValueError, WordError):
+            pass
+        game.extract_output()
+        if game.game_over:
+            game.game_over = False
+
+    timings = asyncio.run(time_async_calls(perform_command, calls, repeat))
+    results["perform_command"] = summarize(timings, calls)
+
+    timings = time_calls(lambda: game.get_look_words(), calls, repeat)
+    results["get_look_words"] = summarize(timings, calls)
+
+    # Every word in every room, as the GUI would look them up.
+    words = [w for room in game.rooms[1:] for w in room.get_look_words(game)]
+
+    # find_commands works them out; active_commands caches them until the
+    # state changes, as when the GUI looks them up again between turns.
+    def find_commands():
+        for word in words:
+            word.find_commands(game)
+
+    timings = time_calls(find_commands, 1, repeat)
+    results["find_commands"] = summarize([t / len(words) for t in timings], len(words))
+
+    def active_commands():
+        for word in words:
+            word.active_commands(game)
+
+    timings = time_calls(active_commands, 1, repeat)
+    results["active_commands"] = summarize([t / len(words) for t in timings], len(words))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--size",
+        action="append",
+        choices=sorted(SIZES),
+        help="game size to generate; may be repeated; default all",
+    )
+    parser.add_argument("--game", action="append", help="also run on this .DAT file")
+    parser.add_argument("--output", help="file to write the JSON to; default stdout")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    games = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in args.size or ([] if args.game else sorted(SIZES)):
+            path = os.path.join(temp_dir, size + ".dat")
+            generate_dat(path, seed=args.seed, **SIZES[size])
+            print(f"running {size}...", file=sys.stderr)
+            games[size] = run_benchmarks(path, args.repeat, args.seed)
+
+        for path in args.game or []:
+            print(f"running {path}...", file=sys.stderr)
+            games[os.path.basename(path)] = run_benchmarks(path, args.repeat, args.seed)
+
+    report = {
+        "suite_version": SUITE_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "sizes": {size: SIZES[size] for size in games if size in SIZES},
+        "results": games,
+    }
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Measures how many turns per second a game runs, with logics yielding to the
+event loop after each action, and with synchronous logic.
+
+Each turn runs the occurances, then a random command built from the game's
+vocabulary. Run from the repository root:
+
+    python -m benchmarks.turns GAME.DAT [--turns N] [--compile]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from compilation import compile_logics
+from extraction import load_extracted
+from game import Game
+
+
+async def play(game, turns, seed):
+    """Plays random commands for up to the number of turns given, stopping if the
+    game ends; returns the number of turns played and the time taken."""
+    rnd = random.Random(seed)
+    random.seed(seed)
+    verbs = sorted(game.verbs)
+    nouns = sorted(game.nouns)
+
+    played = 0
+    start = time.perf_counter()
+    while played < turns and not game.game_over:
+        try:
+            await game.perform_occurances()
+            verb, noun = game.parse_command(rnd.choice(verbs) + " " + rnd.choice(nouns))
+            await game.perform_command(verb, noun)
+        except Exception as e:
+            game.output(str(e))
+        game.extract_output()
+        played += 1
+    return played, time.perf_counter() - start
+
+
+def run(extracted, turns, synchronous, compiled, seed):
+    game = Game(extracted)
+    game.synchronous_logic = synchronous
+    if compiled:
+        compile_logics(game.definition)
+    turns_played, elapsed = asyncio.run(play(game, turns, seed))
+    return turns_played / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("game_file")
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compile", action="store_true", help="compile logics first")
+    args = parser.parse_args()
+    if args.turns < 1:
+        parser.error("--turns must be at least 1")
+
+    extracted = load_extracted(args.game_file)
+    yielding = run(extracted, args.turns, False, args.compile, args.seed)
+    synchronous = run(extracted, args.turns, True, args.compile, args.seed)
+    print(f"yielding after each action: {yielding:10.0f} turns/s")
+    print(f"synchronous logic:          {synchronous:10.0f} turns/s")
+    if yielding > 0:
+        print(f"speedup:                    {synchronous / yielding:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+
+from extraction import DatReader, ExtractedFile
+
+# Bump CACHE_VERSION whenever ExtractedFile changes shape; stale cache
+# files are then ignored and rebuilt.
+CACHE_MAGIC = b"SDCACHE\0"
+CACHE_VERSION = 3
+
+_header = struct.Struct("<8sH32s")
+
+
+def get_cache_dir():
+    """Returns the directory that holds compiled games; this honors XDG_CACHE_HOME."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "scottdumb")
+
+
+def load_game(path, game_factory, cache_dir=None):
+    """Loads the .DAT file at 'path' and returns the game that 'game_factory'
+    builds from its ExtractedFile.
+
+    The decoded file, including the command words the Game works out for each
+    item, is cached in 'cache_dir' under the hash of the file's content, so
+    later loads of the same file skip both parsing and the command word
+    heuristics. If cache_dir is None, get_cache_dir() is used.
+
+    Cache files are unpickled, and so can run arbitrary code; cache_dir must
+    be writable only by the user. We create it with that permission.
+    """
+
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+
+    # The file stays mapped, as the game reads its text from it on demand.
+    with open(path, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    digest = hashlib.sha256(data).digest()
+    cache_path = os.path.join(cache_dir, digest.hex() + ".cache")
+
+    extracted = read_cache(cache_path, digest)
+    if extracted is not None:
+        extracted.attach(data)
+        return game_factory(extracted)
+
+    extracted = ExtractedFile(DatReader(data, lazy=True))
+    game = game_factory(extracted)
+    extracted.command_words = game.definition.get_command_word_indices()
+    extracted.checked = True
+    write_cache(cache_path, digest, extracted)
+    return game
+
+
+def read_cache(cache_path, digest):
+    """Reads a cached ExtractedFile; returns None if there is no usable one.
+
+    A stale or foreign pickle can fail to load in many ways (a missing class
+    or module, a changed __setstate__, and so on), so any error unpickling
+    it just means there is no cache."""
+    try:
+        with open(cache_path, "rb") as file:
+            magic, version, cached_digest = _header.unpack(file.read(_header.size))
+            if (magic, version, cached_digest) != (CACHE_MAGIC, CACHE_VERSION, digest):
+                return None
+            try:
+                extracted = pickle.load(file)
+            except Exception:
+                return None
+    except (OSError, struct.error):
+        return None
+
+    if not isinstance(extracted, ExtractedFile):
+        return None
+    return extracted
+
+
+def write_cache(cache_path, digest, extracted):
+    """Writes an ExtractedFile to the cache. The file is written under a temporary
+    name and then renamed, so a concurrent reader never sees half of it. Failure
+    to write the cache is not an error; we just don't have one."""
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+        with open(temp_path, "wb") as file:
+            file.write(_header.pack(CACHE_MAGIC, CACHE_VERSION, digest))
+            pickle.dump(extracted, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
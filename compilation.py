@@ -0,0 +1,266 @@
+import asyncio
+
+from state import FLAG_COUNT, COUNTER_COUNT, INVENTORY, NOWHERE, DARK_FLAG
+
+# Python expressions for each condition opcode. In these, 'loc' is the
+# location of the item the opcode's value selects, 'room' is the number of
+# the room it selects, 'flag' is the bit for the flag, 'start' is the
+# starting location of the item, and 'val' is the value itself. 'state' is
+# the GameState of the game being played.
+_condition_templates = {
+    1: "{loc} == INVENTORY",
+    2: "{loc} == state.player_loc",
+    3: "{loc} in (state.player_loc, INVENTORY)",
+    4: "state.player_loc == {room}",
+    5: "{loc} != state.player_loc",
+    6: "{loc} != INVENTORY",
+    7: "state.player_loc != {room}",
+    8: "state.flags & {flag} != 0",
+    9: "state.flags & {flag} == 0",
+    10: "state.get_item_count(INVENTORY) > 0",
+    11: "state.get_item_count(INVENTORY) == 0",
+    12: "{loc} not in (state.player_loc, INVENTORY)",
+    13: "{loc} != NOWHERE",
+    14: "{loc} == NOWHERE",
+    15: "state.counter <= {val}",
+    16: "state.counter > {val}",
+    17: "{loc} == {start}",
+    18: "{loc} != {start}",
+    19: "state.counter == {val}",
+}
+
+# Python statements for each action opcode, with the kinds of argument
+# each takes, in order: 'item', 'loc', 'room', 'flag', 'counter' select
+# things by number, as above, and 'val' is the value itself. Later
+# arguments of the same kind are 'item2' and so on. Opcodes not here (the
+# message opcodes aside) run the interpreter's function instead.
+_action_templates = {
+    52: (["item"], ["game.get_item({item})"]),
+    53: (["item"], ["game.drop_item({item})"]),
+    54: (["room"], ["game.move_player({room})"]),
+    55: (["item"], ["game.move_item({item}, NOWHERE)"]),
+    56: ([], [f"state.flags |= {1 << DARK_FLAG}"]),
+    57: ([], [f"state.flags &= ~{1 << DARK_FLAG}"]),
+    58: (["flag"], ["state.flags |= {flag}"]),
+    59: (["item"], ["game.move_item({item}, NOWHERE)"]),
+    60: (["flag"], ["state.flags &= ~{flag}"]),
+    61: (
+        [],
+        [
+            "game.move_player(len(rooms) - 1)",
+            f"state.flags &= ~{1 << DARK_FLAG}",
+        ],
+    ),
+    62: (["item", "room"], ["game.move_item({item}, {room})"]),
+    63: ([], ["game.game_over = True"]),
+    64: ([], ["game.needs_room_update = True"]),
+    65: ([], ["game.check_score()"]),
+    66: ([], ["game.output_inventory_text()"]),
+    67: ([], ["state.flags |= 1"]),
+    68: ([], ["state.flags &= ~1"]),
+    69: (
+        [],
+        [
+            "state.light_remaining = definition.light_duration",
+            "game.move_item(definition.lamp_item, INVENTORY)",
+        ],
+    ),
+    70: ([], []),
+    72: (["item", "item"], ["game.swap_items({item}, {item2})"]),
+    73: ([], ["game.continuing_commands = True"]),
+    74: (["item"], ["game.get_item({item}, force=True)"]),
+    75: (["item", "loc"], ["game.move_item({item}, {loc})"]),
+    76: ([], ["game.needs_room_update = True"]),
+    77: ([], ["if state.counter > 0:", "    state.counter -= 1"]),
+    78: ([], ['game.output(f"{{state.counter}} ")']),
+    79: (["val"], ["state.counter = {val}"]),
+    80: (
+        [],
+        [
+            "saved = state.saved_player_loc",
+            "state.saved_player_loc = state.player_loc",
+            "game.move_player(saved)",
+        ],
+    ),
+    81: (
+        ["counter"],
+        ["state.counter, {counter} = {counter}, state.counter"],
+    ),
+    82: (["val"], ["state.counter += {val}"]),
+    83: (["val"], ["state.counter -= {val}"]),
+    84: ([], ['game.output(game.parsed_noun or "")']),
+    85: ([], ['game.output_line(game.parsed_noun or "")']),
+    86: ([], ["game.output_line()"]),
+    87: (
+        ["val"],
+        [
+            "saved = state.saved_player_locs[{val}]",
+            "state.saved_player_locs[{val}] = state.player_loc",
+            "game.move_player(saved)",
+        ],
+    ),
+}
+
+
+class LogicCompiler:
+    """Generates Python source for the logics of a game definition, and compiles
+    it all at once. Each logic gets a single function that checks all its
+    conditions, and single functions that run all its actions (as a coroutine,
+    and not), with the objects the opcodes refer to bound in advance. As with
+    the interpreted logic, these take the game being played as a parameter, so
+    the compiled code serves every game played from the definition.
+
+    The generated code behaves just like the functions Logic creates, but
+    without a function call per opcode.
+
+    definition - the GameDefinition whose logics are compiled
+    bindings - the objects the generated code refers to, by name
+    used - the names bound for the logic being compiled
+    """
+
+    def __init__(self, definition):
+        self.definition = definition
+        self.bindings = {
+            "definition": definition,
+            "INVENTORY": INVENTORY,
+            "NOWHERE": NOWHERE,
+            "rooms": definition.rooms,
+            "iscoroutine": asyncio.iscoroutine,
+            "sleep": asyncio.sleep,
+        }
+        self.base_names = list(self.bindings)
+        self.used = set()
+
+    def bind(self, prefix, n, value):
+        """Gives a name to an object the generated code uses, and returns it."""
+        name = f"{prefix}{n}"
+        self.bindings[name] = value
+        self.used.add(name)
+        return name
+
+    def resolve(self, kind, n):
+        """Returns the code for the thing of the kind given, selected by number;
+        this binds a name for it, if it is part of the definition. For 'val', this
+        returns the number itself. Raises IndexError if there is no such thing."""
+        definition = self.definition
+        if kind == "item":
+            return self.bind("item", n, definition.items[n])
+        if kind == "loc":
+            definition.items[n]
+            return f"state.item_locs[{n}]"
+        if kind == "start":
+            return str(definition.items[n].starting_loc)
+        if kind == "room":
+            return str(definition.rooms[n].index)
+        if kind == "flag":
+            if n >= FLAG_COUNT:
+                raise IndexError(n)
+            return str(1 << n)
+        if kind == "counter":
+            if n >= COUNTER_COUNT:
+                raise IndexError(n)
+            return f"state.counters[{n}]"
+        return n
+
+    def condition_source(self, logic):
+        """Returns the expression that checks all of a logic's conditions."""
+        parts = []
+        for op, val in logic.condition_ops:
+            template = _condition_templates[op]
+            names = {
+                kind: self.resolve(kind, val)
+                for kind in ("loc", "start", "room", "flag", "val")
+                if "{" + kind + "}" in template
+            }
+            parts.append("(" + template.format(**names) + ")")
+        return " and ".join(parts) if parts else "True"
+
+    def action_source(self, logic, logic_name, awaiting):
+        """Returns the statements that run all of a logic's actions. If awaiting,
+        these are for Logic.execute, and may await; otherwise they are for
+        Logic.execute_now."""
+
+        # Logic.execute yields after each action that is not awaited,
+        # unless the game is set to run logics synchronously.
+        yield_lines = ["if not game.synchronous_logic:", "    await sleep(0.0)"]
+
+        lines = []
+        for index, (op, args) in enumerate(logic.action_ops):
+            if op == 0:
+                pass
+            elif op <= 51:
+                lines.append(f"game.output_message({op})")
+            elif op >= 102:
+                lines.append(f"game.output_message({op - 50})")
+            elif op in _action_templates:
+                kinds, template = _action_templates[op]
+                names = {}
+                for kind, val in zip(kinds, args):
+                    name = kind if kind not in names else f"{kind}2"
+                    names[name] = self.resolve(kind, val)
+                lines += [line.format(**names) for line in template]
+            else:
+                # Fall back to the interpreter, which may return a coroutine.
+                action = self.bind(f"{logic_name}_action", index, logic.actions[index])
+                if not awaiting:
+                    lines.append(f"{action}(game)")
+                    continue
+                lines += [f"result = {action}(game)", "if iscoroutine(result):", "    await result"]
+                lines += ["else:"] + ["    " + line for line in yield_lines]
+                continue
+
+            if awaiting:
+                lines += yield_lines
+        return lines
+
+    def compile(self, logics):
+        """Compiles the logics given, and installs the compiled code in them. Any
+        logic we can't compile keeps using the interpreter. Returns the number of
+        logics compiled."""
+        sources = []
+        compiled = []
+        for n, logic in enumerate(logics):
+            name = f"logic{n}"
+            self.used = set()
+            try:
+                condition = self.condition_source(logic)
+                execute = self.action_source(logic, name, awaiting=True)
+                execute_now = self.action_source(logic, name, awaiting=False)
+            except (IndexError, KeyError):
+                continue  # a bad opcode or argument; the interpreter handles it
+
+            def indent(lines):
+                lines = ["state = game.state"] + lines
+                return "\n".join("        " + line for line in lines)
+
+            # The objects are passed in as parameters, so the generated
+            # functions see them as fast closure variables.
+            params = self.base_names + sorted(self.used)
+            sources.append(
+                f"def make_{name}({', '.join(params)}):\n"
+                f"    def check_conditions(game):\n"
+                f"        state = game.state\n"
+                f"        return {condition}\n"
+                f"    async def execute(game):\n"
+                f"{indent(execute)}\n"
+                f"    def execute_now(game):\n"
+                f"{indent(execute_now)}\n"
+                f"    return check_conditions, execute, execute_now\n"
+            )
+            compiled.append((name, logic, params))
+
+        namespace = {}
+        exec(compile("\n".join(sources), "<compiled logic>", "exec"), namespace)
+        for name, logic, params in compiled:
+            make = namespace[f"make_{name}"]
+            args = [self.bindings[p] for p in params]
+            logic.check_conditions, logic.execute, logic.execute_now = make(*args)
+        return len(compiled)
+
+
+def compile_logics(definition):
+    """Replaces the interpreted conditions and actions of all the logics of a
+    GameDefinition with compiled code, where possible. Every game played from
+    the definition then uses the compiled code. Returns the number of logics
+    compiled."""
+    return LogicCompiler(definition).compile(definition.commands + definition.occurances)
@@ -1,42 +1,125 @@
 import asyncio
+from functools import cached_property, partial
 from random import randint
 
+from state import FLAG_COUNT, COUNTER_COUNT, INVENTORY, NOWHERE, DARK_FLAG
+
+# The number of arguments each action opcode takes; see create_action().
+# Opcodes not here take none.
+_action_arg_counts = {
+    52: 1, 53: 1, 54: 1, 55: 1, 58: 1, 59: 1, 60: 1, 62: 2, 72: 2,
+    74: 1, 75: 2, 79: 1, 81: 1, 82: 1, 83: 1, 87: 1, 89: 1,
+}
+
 
 class Logic:
     """This class contains the actual opcodes to execute for the game.
 
     Subclasses override methods to control when this can execute, but the
     actual execution is all here.
-    """
 
-    def __init__(self, game, extracted_action):
-        self.game = game
-        self.conditions = []
-        args = []
-        for val, op in extracted_action.conditions:
-            if op == 0:
-                args.append(val)
-            else:
-                self.conditions.append(self.create_condition(op, val))
-
-        def get_arg():
-            val = args[0]
-            del args[0]
-            return val
-
-        self.actions = []
-        for op in extracted_action.actions:
-            self.actions.append(self.create_action(op, get_arg))
+    Logics belong to a GameDefinition, and are shared by every game played
+    from it, so the game to check or change is passed to each method.
+
+    extracted_action - the ExtractedAction this logic comes from
+    conditions - functions that implement the conditions; each takes the game
+    actions - functions that implement the actions; each takes the game
+    condition_ops - the conditions as (opcode, value) tuples
+    action_ops - the actions as (opcode, [arguments]) tuples
+    is_async - true if any action must be awaited (wait, or save game);
+               otherwise execute_now() can run the actions.
+
+    A game has thousands of logics, and most never run, so these are worked
+    out from the extracted action only when first used.
+
+    What the conditions read from the game state; see find_dependencies().
+    Occurances set these when created, as the definition indexes them so:
+
+    reads_items - the indices of the items whose locations they read
+    reads_flags - the flags they read, as a bitmask
+    reads_counter - true if they read the counter
+    reads_player_loc - true if they compare the player's location with an
+                       item's
+    reads_rooms - the rooms they check whether the player is in
+    reads_inventory - true if they read how many items are carried
+    """
 
-    @property
-    def is_available(self):
+    def __init__(self, definition, extracted_action):
+        self.definition = definition
+        self.extracted_action = extracted_action
+
+    @cached_property
+    def condition_ops(self):
+        return [(op, val) for val, op in self.extracted_action.conditions if op != 0]
+
+    @cached_property
+    def action_ops(self):
+        # The arguments are the values of the 'argument carrier' conditions,
+        # opcode 0; each action takes as many of them as it needs, in order.
+        args = [val for val, op in self.extracted_action.conditions if op == 0]
+        action_ops = []
+        for op in self.extracted_action.actions:
+            count = _action_arg_counts.get(op, 0)
+            action_ops.append((op, args[:count]))
+            del args[:count]
+        return action_ops
+
+    @cached_property
+    def conditions(self):
+        return [self.create_condition(op, val) for op, val in self.condition_ops]
+
+    @cached_property
+    def actions(self):
+        return [self.create_action(op, partial(list(args).pop, 0)) for op, args in self.action_ops]
+
+    @cached_property
+    def is_async(self):
+        return any(op in (71, 88) for op, _ in self.action_ops)
+
+    def create_functions(self):
+        """Creates the functions for the conditions and actions now, rather
+        than when they are first used. This raises if there is a bad opcode
+        or argument."""
+        return self.conditions, self.actions
+
+    def find_dependencies(self):
+        """Works out what parts of the game state the conditions read, so
+        a cached result of check_conditions() need only be discarded when
+        one of them changes."""
+        self.reads_items = set()
+        self.reads_flags = 0
+        self.reads_counter = False
+        self.reads_player_loc = False
+        self.reads_rooms = set()
+        self.reads_inventory = False
+
+        for op, val in self.condition_ops:
+            if op in (1, 2, 3, 5, 6, 12, 13, 14, 17, 18):
+                self.reads_items.add(val)
+            if op in (2, 3, 5, 12):
+                self.reads_player_loc = True
+            if op in (4, 7):
+                self.reads_rooms.add(val)
+            if op in (8, 9):
+                self.reads_flags |= 1 << val
+            if op in (10, 11):
+                self.reads_inventory = True
+            if op in (15, 16, 19):
+                self.reads_counter = True
+
+    def is_available(self, game):
         """Runs conditions for the logic; returns true if this logic can execute."""
+        return self.check_conditions(game)
+
+    def check_conditions(self, game):
+        """Implements is_available, by running each condition function. The
+        compilation module can replace this with faster code."""
         for c in self.conditions:
-            if not c():
+            if not c(game):
                 return False
         return True
 
-    def check_occurance(self):
+    def check_occurance(self, game):
         """True if this is an occurance that should run now.
 
         This rolls the dice for the chance of the occurance, so repeated
@@ -44,16 +127,16 @@ class Logic:
         """
         return False
 
-    def check_command(self, verb, noun):
+    def check_command(self, game, verb, noun):
         """True if this is a command to handle the user command indicated
         by verb and noun. Also checks availability."""
         return False
 
-    def check_available_noun(self, noun):
+    def check_available_noun(self, game, noun):
         """True if this is a command that uses the given noun. Also checks availability."""
         return False
 
-    def check_available_verb(self, verb):
+    def check_available_verb(self, game, verb):
         """True if this is a command that uses the given verb. Also checks availability."""
         return False
 
@@ -62,18 +145,30 @@ class Logic:
         """True if this is a continuation action; is_available must be checked separately."""
         return False
 
-    async def execute(self):
-        """Runs the action. This applies changes to self.game. If any of the actions are co-routines,
-        this will await them."""
+    async def execute(self, game):
+        """Runs the action. This applies changes to the game. If any of the actions are co-routines,
+        this will await them. Unless game.synchronous_logic is set, this also yields to the
+        event loop after each other action.
+
+        The compilation module can replace this with faster code."""
+        yield_each = not game.synchronous_logic
         for a in self.actions:
-            t = a()
+            t = a(game)
             if asyncio.iscoroutine(t):
                 await t
-            else:
+            elif yield_each:
                 await asyncio.sleep(0.0)
 
+    def execute_now(self, game):
+        """Runs the action at once, without involving the event loop. This is
+        only for logics whose is_async is false.
+
+        The compilation module can replace this with faster code."""
+        for a in self.actions:
+            a(game)
+
     def create_condition(self, op, val):
-        """Returns a function (no arguments, returns a boolean) that
+        """Returns a function (taking the game, returning a boolean) that
         implements a condition, given its opcode and value.
 
         This does not handle opcode 0, the 'argument carrier' for action opcodes-
@@ -83,53 +178,55 @@ class Logic:
         def undefined():
             raise ValueError(f"Undefined condition op: {op}")
 
-        game = self.game
+        definition = self.definition
+        items = definition.items
+        rooms = definition.rooms
 
         if op == 1:
-            return lambda: game.items[val].room == game.inventory
+            return lambda game: game.state.item_locs[val] == INVENTORY
         if op == 2:
-            return lambda: game.items[val].room == game.player_room
+            return lambda game: game.state.item_locs[val] == game.state.player_loc
         if op == 3:
-            return lambda: game.items[val].room in [game.player_room, game.inventory]
+            return lambda game: game.state.item_locs[val] in (game.state.player_loc, INVENTORY)
         if op == 4:
-            return lambda: game.player_room == game.rooms[val]
+            return lambda game: game.state.player_loc == rooms[val].index
         if op == 5:
-            return lambda: game.items[val].room != game.player_room
+            return lambda game: game.state.item_locs[val] != game.state.player_loc
         if op == 6:
-            return lambda: game.items[val].room != game.inventory
+            return lambda game: game.state.item_locs[val] != INVENTORY
         if op == 7:
-            return lambda: game.player_room != game.rooms[val]
+            return lambda game: game.state.player_loc != rooms[val].index
         if op == 8:
-            return lambda: game.flags[val].state
+            return lambda game: game.state.get_flag(val)
         if op == 9:
-            return lambda: not game.flags[val].state
+            return lambda game: not game.state.get_flag(val)
         if op == 10:
-            return lambda: len(game.inventory.get_items()) > 0
+            return lambda game: game.state.get_item_count(INVENTORY) > 0
         if op == 11:
-            return lambda: len(game.inventory.get_items()) == 0
+            return lambda game: game.state.get_item_count(INVENTORY) == 0
         if op == 12:
-            return lambda: game.items[val].room not in [
-                game.player_room,
-                game.inventory,
-            ]
+            return lambda game: game.state.item_locs[val] not in (
+                game.state.player_loc,
+                INVENTORY,
+            )
         if op == 13:
-            return lambda: game.items[val].room is not None
+            return lambda game: game.state.item_locs[val] != NOWHERE
         if op == 14:
-            return lambda: game.items[val].room is None
+            return lambda game: game.state.item_locs[val] == NOWHERE
         if op == 15:
-            return lambda: game.counter.value <= val
+            return lambda game: game.state.counter <= val
         if op == 16:
-            return lambda: game.counter.value > val
+            return lambda game: game.state.counter > val
         if op == 17:
-            return lambda: game.items[val].room == game.items[val].starting_room
+            return lambda game: game.state.item_locs[val] == items[val].starting_loc
         if op == 18:
-            return lambda: game.items[val].room != game.items[val].starting_room
+            return lambda game: game.state.item_locs[val] != items[val].starting_loc
         if op == 19:
-            return lambda: game.counter.value == val
+            return lambda game: game.state.counter == val
         return undefined()
 
     def create_action(self, op, value_source):
-        """Returns a function (no arguments, returns nothing) that implements
+        """Returns a function (taking the game, returning nothing) that implements
         an action opcode.
 
         value_source is not an opcode argument, but a function that extracts the
@@ -137,129 +234,144 @@ class Logic:
         things.) It can be called repeatedly for multiple arguments.
         """
 
-        game = self.game
+        definition = self.definition
 
-        def clear_screen():
+        # The common opcodes are handled before we define all the
+        # closures below, as that is costly when loading a game.
+        if op == 0:
+            return lambda game: None
+        if op <= 51:
+            return lambda game: game.output_message(op)
+        if op >= 102:
+            return lambda game: game.output_message(op - 50)
+
+        def check_index(index, count):
+            # Flags and counters belong to each game, so we check the
+            # numbers here, before any game uses them.
+            if index >= count:
+                raise IndexError(f"Flag or counter number out of range: {index}")
+            return index
+
+        def clear_screen(game):
             pass  # we don't do this
 
-        def get_item():
+        def get_item(game):
             game.get_item(item)
 
-        def superget_item():
+        def superget_item(game):
             game.get_item(item, force=True)
 
-        def drop_item():
+        def drop_item(game):
             game.drop_item(item)
 
-        def move_item():
-            game.move_item(item, room)
+        def move_item(game):
+            game.move_item(item, loc)
 
-        def remove_item():
-            game.move_item(item, None)
+        def remove_item(game):
+            game.move_item(item, NOWHERE)
 
-        def swap_items():
+        def swap_items(game):
             game.swap_items(item1, item2)
 
-        def put_item_with():
-            game.move_item(item1, item2.room)
+        def put_item_with(game):
+            game.move_item(item1, game.state.item_locs[item2.index])
 
-        def move_player():
-            game.move_player(room)
+        def move_player(game):
+            game.move_player(loc)
 
-        def swap_loc():
-            saved_player_room = game.saved_player_room
-            game.saved_player_room = game.player_room
-            game.move_player(saved_player_room)
+        def swap_loc(game):
+            state = game.state
+            saved_player_loc = state.saved_player_loc
+            state.saved_player_loc = state.player_loc
+            game.move_player(saved_player_loc)
 
-        def set_counter():
-            game.counter.value = counter_value
+        def set_counter(game):
+            game.state.counter = counter_value
 
-        def swap_counter():
-            counter.swap(game)
+        def swap_counter(game):
+            state = game.state
+            state.counter, state.counters[counter] = state.counters[counter], state.counter
 
-        def add_counter():
-            game.counter.value += counter_value
+        def add_counter(game):
+            game.state.counter += counter_value
 
-        def subtract_counter():
-            game.counter.value -= counter_value
+        def subtract_counter(game):
+            game.state.counter -= counter_value
 
-        def decrement_counter():
-            if game.counter.value > 0:
-                game.counter.value -= 1
+        def decrement_counter(game):
+            if game.state.counter > 0:
+                game.state.counter -= 1
 
-        def print_counter():
-            game.output(f"{game.counter.value} ")
+        def print_counter(game):
+            game.output(f"{game.state.counter} ")
 
-        def set_flag():
-            flag.state = True
+        def set_flag(game):
+            game.state.flags |= 1 << flag
 
-        def reset_flag():
-            flag.state = False
+        def reset_flag(game):
+            game.state.flags &= ~(1 << flag)
 
-        def die():
-            game.move_player(game.rooms[len(game.rooms) - 1])
-            game.dark_flag.state = False
+        def die(game):
+            game.move_player(len(definition.rooms) - 1)
+            game.state.set_flag(DARK_FLAG, False)
 
-        def game_over():
+        def game_over(game):
             game.game_over = True
 
-        def check_score():
+        def check_score(game):
             game.check_score()
 
-        def save_game():
-            game.save_game()
+        def save_game(game):
+            return game.save_game()
 
-        def describe_room():
+        def describe_room(game):
             game.needs_room_update = True
 
-        def refill_lamp():
-            game.light_remaining = game.light_duration
-            game.move_item(game.lamp_item, game.inventory)
+        def refill_lamp(game):
+            game.state.light_remaining = definition.light_duration
+            game.move_item(definition.lamp_item, INVENTORY)
 
-        def swap_specific_loc():
-            saved_player_room = game.saved_player_rooms[saved_room_value]
-            game.saved_player_rooms[saved_room_value] = game.player_room
-            game.move_player(saved_player_room)
+        def swap_specific_loc(game):
+            state = game.state
+            saved_player_loc = state.saved_player_locs[saved_room_value]
+            state.saved_player_locs[saved_room_value] = state.player_loc
+            game.move_player(saved_player_loc)
 
-        def continue_actions():
+        def continue_actions(game):
             game.continuing_commands = True
 
         def undefined():
             raise ValueError(f"Undefined action op: {op}")
 
-        if op == 0:
-            return lambda: None
-        if op <= 51:
-            return lambda: game.output_line(game.messages[op])
         if op == 52:
-            item = game.items[value_source()]
+            item = definition.items[value_source()]
             return get_item
         if op == 53:
-            item = game.items[value_source()]
+            item = definition.items[value_source()]
             return drop_item
         if op == 54:
-            room = game.rooms[value_source()]
+            loc = definition.rooms[value_source()].index
             return move_player
         if op == 55 or op == 59:
-            item = game.items[value_source()]
+            item = definition.items[value_source()]
             return remove_item
         if op == 56:
-            flag = game.dark_flag
+            flag = DARK_FLAG
             return set_flag
         if op == 57:
-            flag = game.dark_flag
+            flag = DARK_FLAG
             return reset_flag
         if op == 58:
-            flag = game.flags[value_source()]
+            flag = check_index(value_source(), FLAG_COUNT)
             return set_flag
         if op == 60:
-            flag = game.flags[value_source()]
+            flag = check_index(value_source(), FLAG_COUNT)
             return reset_flag
         if op == 61:
             return die
         if op == 62:
-            item = game.items[value_source()]
-            room = game.rooms[value_source()]
+            item = definition.items[value_source()]
+            loc = definition.rooms[value_source()].index
             return move_item
         if op == 63:
             return game_over
@@ -268,12 +380,12 @@ class Logic:
         if op == 65:
             return check_score
         if op == 66:
-            return lambda: game.output_inventory_text()
+            return lambda game: game.output_inventory_text()
         if op == 67:
-            flag = game.flags[0]
+            flag = 0
             return set_flag
         if op == 68:
-            flag = game.flags[0]
+            flag = 0
             return reset_flag
         if op == 69:
             return refill_lamp
@@ -282,17 +394,17 @@ class Logic:
         if op == 71:
             return save_game
         if op == 72:
-            item1 = game.items[value_source()]
-            item2 = game.items[value_source()]
+            item1 = definition.items[value_source()]
+            item2 = definition.items[value_source()]
             return swap_items
         if op == 73:
             return continue_actions
         if op == 74:
-            item = game.items[value_source()]
+            item = definition.items[value_source()]
             return superget_item
         if op == 75:
-            item1 = game.items[value_source()]
-            item2 = game.items[value_source()]
+            item1 = definition.items[value_source()]
+            item2 = definition.items[value_source()]
             return put_item_with
         if op == 77:
             return decrement_counter
@@ -304,7 +416,7 @@ class Logic:
         if op == 80:
             return swap_loc
         if op == 81:
-            counter = game.counters[value_source()]
+            counter = check_index(value_source(), COUNTER_COUNT)
             return swap_counter
         if op == 82:
             counter_value = value_source()
@@ -313,26 +425,24 @@ class Logic:
             counter_value = value_source()
             return subtract_counter
         if op == 84:
-            return lambda: game.output(game.parsed_noun or "")
+            return lambda game: game.output(game.parsed_noun or "")
         if op == 85:
-            return lambda: game.output_line(game.parsed_noun or "")
+            return lambda game: game.output_line(game.parsed_noun or "")
         if op == 86:
-            return lambda: game.output_line()
+            return lambda game: game.output_line()
         if op == 87:
             saved_room_value = value_source()
             return swap_specific_loc
         if op == 88:
 
-            async def wait():
+            async def wait(game):
                 game.flush_output()
-                await asyncio.sleep(2.0)
+                await asyncio.sleep(game.wait_seconds)
 
             return wait
         if op == 89:
             picture = value_source()
             raise NotImplementedError(f"Action 89: SAGA graphics not supported (picture {picture})")
-        if op >= 102:
-            return lambda: game.output_line(game.messages[op - 50])
         return undefined()
 
 
@@ -342,37 +452,42 @@ class Occurance(Logic):
     run now and again.
     """
 
-    def __init__(self, game, extracted_action):
-        Logic.__init__(self, game, extracted_action)
+    def __init__(self, definition, extracted_action):
+        Logic.__init__(self, definition, extracted_action)
         self.chance = extracted_action.noun
+        self.find_dependencies()
+
+    def check_occurance(self, game):
+        return self.check_conditions(game) and self.check_chance()
 
-    def check_occurance(self):
-        return self.is_available and randint(1, 100) <= self.chance
+    def check_chance(self):
+        """Rolls the dice; true if the occurance should run, if available."""
+        return randint(1, 100) <= self.chance
 
 
 class Command(Logic):
     """These logics handle specific user commands."""
 
-    def __init__(self, game, extracted, extracted_action):
-        Logic.__init__(self, game, extracted_action)
+    def __init__(self, definition, extracted, extracted_action):
+        Logic.__init__(self, definition, extracted_action)
         verb_index = extracted_action.verb
         noun_index = extracted_action.noun
-        self.verb = game.get_verb(extracted.verbs[verb_index])
+        self.verb = definition.get_verb(extracted.verbs[verb_index])
         self.noun = (
-            game.get_noun(extracted.nouns[noun_index]) if noun_index > 0 else None
+            definition.get_noun(extracted.nouns[noun_index]) if noun_index > 0 else None
         )
 
-    def check_command(self, verb, noun):
+    def check_command(self, game, verb, noun):
         if self.verb == verb:
             if self.noun is None or self.noun == noun:
-                return self.is_available
+                return self.check_conditions(game)
         return False
 
-    def check_available_noun(self, noun):
-        return self.noun == noun and self.is_available
+    def check_available_noun(self, game, noun):
+        return self.noun == noun and self.check_conditions(game)
 
-    def check_available_verb(self, verb):
-        return self.verb == verb and self.noun is None and self.is_available
+    def check_available_verb(self, game, verb):
+        return self.verb == verb and self.noun is None and self.check_conditions(game)
 
 
 class Continuation(Logic):
@@ -380,8 +495,8 @@ class Continuation(Logic):
     which they follow. They run if a command executes the continue opcode, and
     if their condition is also met."""
 
-    def __init__(self, game, extracted_action):
-        Logic.__init__(self, game, extracted_action)
+    def __init__(self, definition, extracted_action):
+        Logic.__init__(self, definition, extracted_action)
 
     @property
     def is_continuation(self):
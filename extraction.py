@@ -1,3 +1,10 @@
+import mmap
+import re
+from array import array
+from collections import OrderedDict
+from functools import cached_property
+
+
 class ExtractedFile:
     """Contiains all the data from file which it reads when constructed.
 
@@ -14,50 +21,94 @@ class ExtractedFile:
     grouped_nouns - groups of synonyms (a list of lists)
     grouped_verbs - groups of synonyms (a list of lists)
     rooms - list of ExtractedRooms
+    room_descriptions - the rooms' descriptions, in room order
     messages - list of messages
     items - list of ExractedItems
+    command_words - the nouns that refer to each item, as lists of indices
+                    into grouped_nouns, in item order; None until a
+                    GameDefinition works them out.
+    checked - true if a GameDefinition has been built from this file before,
+              so its actions are known to be good; the cache sets this.
     """
 
     def __init__(self, file):
-        read_num(file)  # unknown value
-        max_item_index = read_num(file)
-        max_action_index = read_num(file)
-        max_word_index = read_num(file)
-        max_room_index = read_num(file)
-        self.max_carried = read_num(file)
-        self.starting_room = read_num(file)
-        self.treasure_count = read_num(file)
-        self.word_length = read_num(file)
-        self.light_duration = read_num(file)
-        max_message_index = read_num(file)
-        self.treasure_room = read_num(file)
-
-        self.actions = []
-        for i in range(0, max_action_index + 1):
-            self.actions.append(ExtractedAction(file))
-
-        self.verbs = []
-        self.nouns = []
-        for i in range(0, max_word_index + 1):
-            self.verbs.append(read_string(file))
-            self.nouns.append(read_string(file))
+        # 'file' can be a text file, or a DatReader over the whole file.
+        reader = file if isinstance(file, DatReader) else LineReader(file)
+
+        (
+            _,  # unknown value
+            max_item_index,
+            max_action_index,
+            max_word_index,
+            max_room_index,
+            self.max_carried,
+            self.starting_room,
+            self.treasure_count,
+            self.word_length,
+            self.light_duration,
+            max_message_index,
+            self.treasure_room,
+        ) = reader.read_nums(12)
+
+        # Most of a file is numbers, so we read them all at once.
+        action_nums = reader.read_nums((max_action_index + 1) * 8)
+        self.actions = [
+            ExtractedAction(action_nums[i : i + 8]) for i in range(0, len(action_nums), 8)
+        ]
+
+        words = reader.read_strings((max_word_index + 1) * 2)
+        self.verbs = words[0::2]
+        self.nouns = words[1::2]
         self.grouped_verbs = group_words(self.verbs)
         self.grouped_nouns = group_words(self.nouns)
 
+        # These texts can be LazyTextTables, which decode each only
+        # when it is used.
+        self.room_descriptions = reader.new_text_table()
         self.rooms = []
         for i in range(0, max_room_index + 1):
-            self.rooms.append(ExtractedRoom(file))
+            self.rooms.append(ExtractedRoom(reader, self.room_descriptions))
 
-        self.messages = []
-        for i in range(0, max_message_index + 1):
-            self.messages.append(read_string(file))
+        self.messages = reader.new_text_table()
+        reader.read_texts_into(self.messages, max_message_index + 1)
 
         self.items = []
         for i in range(0, max_item_index + 1):
-            self.items.append(ExtractedItem(file))
-
-        for a in self.actions:
-            a.comment = read_string(file).strip()
+            self.items.append(ExtractedItem(reader))
+
+        comments = reader.read_strings(len(self.actions))
+        for a, comment in zip(self.actions, comments):
+            a.comment = comment.strip()
+
+        self.command_words = None
+        self.checked = False
+
+    def __getstate__(self):
+        # Thousands of small ExtractedActions are slow to unpickle, so we
+        # pickle one flat array of their numbers instead, and rebuild them.
+        state = dict(self.__dict__)
+        nums = [n for a in self.actions for n in a.nums]
+        try:
+            state["actions"] = array("q", nums)
+        except OverflowError:
+            state["actions"] = nums
+        state["action_comments"] = [a.comment for a in self.actions]
+        return state
+
+    def __setstate__(self, state):
+        nums = state.pop("actions")
+        comments = state.pop("action_comments")
+        self.__dict__.update(state)
+        self.actions = [ExtractedAction(nums[i : i + 8]) for i in range(0, len(nums), 8)]
+        for a, comment in zip(self.actions, comments):
+            a.comment = comment
+
+    def attach(self, data):
+        """Supplies the DAT buffer to any LazyTextTables; an unpickled
+        ExtractedFile needs this before its text can be read."""
+        for table in (self.room_descriptions, self.messages):
+            if isinstance(table, LazyTextTable):
+                table.data = data
 
 
 class ExtractedAction:
@@ -69,22 +120,29 @@ class ExtractedAction:
 
     conditions - list of tuples (condition-op, value)
     actions = list of action bytecodes
+    nums - the action's eight numbers, as in the file
+
+    The conditions and actions are split out of the numbers when first used,
+    as most actions never run.
     """
 
-    def __init__(self, file):
-        input_num = read_num(file)
-        self.verb, self.noun = split_number(input_num, 150)
-        condition_nums = [
-            read_num(file),
-            read_num(file),
-            read_num(file),
-            read_num(file),
-            read_num(file),
-        ]
-        self.conditions = [split_number(c, 20) for c in condition_nums]
+    def __init__(self, nums):
+        # There are a great many actions, so the usual non-negative numbers
+        # are split with divmod.
+        self.nums = nums
+        verb_noun = nums[0]
+        self.verb, self.noun = divmod(verb_noun, 150) if verb_noun >= 0 else split_number(verb_noun, 150)
+
+    @cached_property
+    def conditions(self):
+        return [divmod(c, 20) if c >= 0 else split_number(c, 20) for c in self.nums[1:6]]
 
-        action_nums = [read_num(file), read_num(file)]
-        self.actions = [s for a in action_nums for s in split_number(a, 150)]
+    @cached_property
+    def actions(self):
+        a1, a2 = self.nums[6:8]
+        if a1 >= 0 and a2 >= 0:
+            return [*divmod(a1, 150), *divmod(a2, 150)]
+        return [*split_number(a1, 150), *split_number(a2, 150)]
 
 
 class ExtractedRoom:
@@ -99,14 +157,22 @@ class ExtractedRoom:
     down - room # down of this one.
     """
 
-    def __init__(self, file):
-        self.north = read_num(file)
-        self.south = read_num(file)
-        self.east = read_num(file)
-        self.west = read_num(file)
-        self.up = read_num(file)
-        self.down = read_num(file)
-        self.description = read_string(file)
+    def __init__(self, reader, descriptions):
+        (
+            self.north,
+            self.south,
+            self.east,
+            self.west,
+            self.up,
+            self.down,
+        ) = reader.read_nums(6)
+        self.descriptions = descriptions
+        self.index = len(descriptions)
+        reader.read_text_into(descriptions)
+
+    @property
+    def description(self):
+        return self.descriptions[self.index]
 
 
 class ExtractedItem:
@@ -118,9 +184,8 @@ class ExtractedItem:
                  dropping it; if None item can't be carried.
     """
 
-    def __init__(self, file):
-        self.description, extra = read_string_plus(file)
-        self.starting_room = int(extra)
+    def __init__(self, reader):
+        self.description, self.starting_room = reader.read_string_plus_num()
         self.carry_word = None
 
         if self.description.endswith("/"):
@@ -131,6 +196,430 @@ class ExtractedItem:
             self.description = self.description[:wordstart]
 
 
+# Readers
+
+
+class LineReader:
+    """Reads values from a text file, one line at a time."""
+
+    def __init__(self, file):
+        self.file = file
+
+    def read_num(self):
+        return read_num(self.file)
+
+    def read_nums(self, count):
+        return [read_num(self.file) for n in range(count)]
+
+    def read_string_plus(self):
+        return read_string_plus(self.file)
+
+    def read_string_plus_num(self):
+        text, extra = read_string_plus(self.file)
+        return (text, int(extra))
+
+    def read_string(self):
+        return read_string(self.file)
+
+    def new_text_table(self):
+        return []
+
+    def read_strings(self, count):
+        return [read_string(self.file) for n in range(count)]
+
+    def read_text_into(self, table):
+        table.append(read_string(self.file))
+
+    def read_texts_into(self, table, count):
+        table.extend(self.read_strings(count))
+
+
+# Each value in a DAT file starts on its own line. It is either a number, or a
+# double-quoted string that may span lines and may have extra text after the
+# closing quote. As strings can't contain quotes, a file is a series of strings,
+# each after a gap that holds the numbers that come before it, and then a
+# trailer. This matches each gap, string and extra text in turn.
+_string_re = re.compile(rb'([^"]*)"([^"]*)"([^\r\n]*)')
+_line_break_re = re.compile(rb"\r\n|\r|\n")
+_leading_num_re = re.compile(rb"[-+]?[0-9]+")
+_two_values_re = re.compile(rb"\S[ \t\v\f]+\S")
+
+# The gaps between strings that hold no numbers, and are laid out correctly.
+_plain_gaps = (b"\n", b"\r\n", b"\r")
+
+
+class DatReader:
+    """Reads values from a buffer holding a whole DAT file (bytes or an mmap).
+
+    This splits the entire buffer into strings and the gaps between them with
+    one regular expression. The numbers in each gap are converted together,
+    and so are runs of strings, rather than value by value; errors are reported
+    with the byte offset of the bad value.
+
+    In strict mode this rejects anything the line-at-a-time reader would, such
+    as blank lines, strings that do not start their line, or junk after a number,
+    and also text that is not valid in the encoding given.
+
+    If lazy is true, text tables are LazyTextTables that keep only byte offsets
+    into 'data'; in that case 'data' must stay open as long as they are in use.
+    """
+
+    def __init__(self, data, strict=False, encoding="utf-8", lazy=False):
+        self.data = data
+        self.strict = strict
+        self.encoding = encoding
+        self.errors = "strict" if strict else "replace"
+        self.lazy = lazy
+        self.has_cr = data.find(b"\r") >= 0
+
+        # (gap, text, extra) for each string
+        self.strings = _string_re.findall(data)
+        self.offsets = None
+
+        # The next string to read, and the numbers in the gap before it once
+        # they are converted; 'position' indexes the next of those to read.
+        self.index = 0
+        self.nums = None
+        self.position = 0
+
+    def get_offsets(self):
+        """Returns a list of the byte offset of each string's text, with the
+        offset of the trailer at the end."""
+        if self.offsets is None:
+            offsets = []
+            offset = 0
+            for gap, text, extra in self.strings:
+                offset += len(gap) + 1
+                offsets.append(offset)
+                offset += len(text) + 1 + len(extra)
+            offsets.append(offset + 1)
+            self.offsets = offsets
+        return self.offsets
+
+    def get_gap(self, index):
+        """Returns the gap before string 'index', or the trailer if that is
+        past the last string."""
+        if index < len(self.strings):
+            return self.strings[index][0]
+        return bytes(self.data[self.get_offsets()[-1] - 1 :])
+
+    def get_nums(self):
+        """Returns the numbers in the gap before the next string, converting
+        them if that has not been done yet."""
+        if self.nums is None:
+            index = self.index
+            gap = self.get_gap(index)
+            nums = None
+
+            # This way works only if each line of the gap holds exactly one
+            # number, and the string's own line nothing before it; anything
+            # else is left to parse_gap(), so both ways give the same numbers.
+            # With no line holding two values, there is one per line when
+            # there are as many as there are lines.
+            line_breaks = gap.count(b"\n")
+            tail = gap[gap.rfind(b"\n") + 1 :]
+            if self.has_cr:
+                line_breaks += gap.count(b"\r") - gap.count(b"\r\n")
+                tail = tail[tail.rfind(b"\r") + 1 :]
+            first = 0 if index == 0 else 1
+            if index < len(self.strings):
+                lines = line_breaks - first
+                plain = tail == b"" or not (self.strict or tail.strip())
+            else:
+                lines = line_breaks + 1 - first
+                plain = True
+            parts = gap.split()
+            if plain and lines == len(parts) and not _two_values_re.search(gap):
+                try:
+                    nums = list(map(int, parts))
+                except ValueError:
+                    pass
+
+            self.nums = nums if nums is not None else self.parse_gap(index)[0]
+            self.position = 0
+        return self.nums
+
+    def parse_gap(self, index):
+        """Reads the numbers in the gap before string 'index' a line at a time.
+        Returns them, and the offset of each; raises DatError if the gap is
+        malformed."""
+        gap = self.get_gap(index)
+        offset = self.get_offsets()[index] - 1
+        if index < len(self.strings):
+            offset -= len(gap)
+        lines = _line_break_re.split(gap)
+        line_breaks = _line_break_re.findall(gap)
+        # Past the first string, the first 'line' is the empty rest of the
+        # string's line; before a string, the last is the start of its line.
+        first = 0 if index == 0 else 1
+        last = len(lines) - 1 if index < len(self.strings) else len(lines)
+
+        nums = []
+        offsets = []
+        line_start = offset
+        for n, line in enumerate(lines):
+            value_offset = line_start + len(line) - len(line.lstrip())
+            if n < len(line_breaks):
+                line_start += len(line) + len(line_breaks[n])
+
+            token = line.strip()
+            if n < first:
+                continue
+            elif n == last:
+                if line != b"" and (self.strict or token != b""):
+                    raise DatError(value_offset, "string does not start its line")
+            elif token == b"":
+                if self.strict:
+                    raise DatError(value_offset, "expected one value per line")
+            else:
+                try:
+                    nums.append(int(token))
+                except ValueError:
+                    m = _leading_num_re.match(token)
+                    if m is None:
+                        raise DatError(value_offset, "expected a number")
+                    if self.strict:
+                        raise DatError(value_offset + m.end(), "unexpected text after number")
+                    nums.append(int(m.group()))
+                offsets.append(value_offset)
+        return nums, offsets
+
+    def read_num(self):
+        return self.read_nums(1)[0]
+
+    def read_nums(self, count):
+        nums = self.get_nums()
+        start = self.position
+        if start + count > len(nums):
+            if self.index < len(self.strings):
+                raise DatError(self.get_offsets()[self.index] - 1, "expected a number")
+            raise DatError(len(self.data), "unexpected end of file")
+        self.position = start + count
+        return nums[start : start + count]
+
+    def check_no_numbers(self):
+        """Raises DatError if there are numbers before the next string that
+        have not been read."""
+        index = self.index
+        if index > 0 and self.nums is None and self.strings[index][0] in _plain_gaps:
+            return
+        nums = self.get_nums()
+        if self.position < len(nums):
+            offsets = self.parse_gap(index)[1]
+            if self.position < len(offsets):
+                raise DatError(offsets[self.position], "expected a string")
+            raise DatError(self.get_offsets()[index] - 1, "expected a string")
+
+    def take_strings(self, count):
+        """Moves past the next 'count' strings, and returns their (gap, text,
+        extra) tuples."""
+        index = self.index
+        strings = self.strings[index : index + count]
+        if len(strings) < count:
+            raise DatError(len(self.data), "unexpected end of file")
+
+        self.check_no_numbers()
+        for n in range(1, count):
+            if strings[n][0] not in _plain_gaps:
+                self.index = index + n
+                self.nums = None
+                self.check_no_numbers()
+
+        self.index = index + count
+        self.nums = None
+        return strings
+
+    def decode(self, raw, offset):
+        """Decodes text from the file, which was at 'offset'."""
+        try:
+            text = raw.decode(self.encoding, self.errors)
+        except UnicodeDecodeError as e:
+            raise DatError(offset + e.start, f"invalid {self.encoding} text")
+        if self.has_cr:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text
+
+    def decode_strings(self, strings, index):
+        """Decodes the texts of (gap, text, extra) tuples, which are the strings
+        from 'index' on."""
+        encoding = self.encoding
+        errors = self.errors
+        try:
+            texts = [text.decode(encoding, errors) for gap, text, extra in strings]
+        except UnicodeDecodeError:
+            # to find the bad one, and where it is
+            offsets = self.get_offsets()
+            for n, (gap, text, extra) in enumerate(strings):
+                self.decode(text, offsets[index + n])
+            raise
+        if self.strict:
+            # The extra text is discarded, but must be valid all the same.
+            offsets = self.get_offsets()
+            for n, (gap, text, extra) in enumerate(strings):
+                if extra != b"":
+                    self.decode(extra, offsets[index + n] + len(text) + 1)
+        if self.has_cr:
+            texts = [t.replace("\r\n", "\n").replace("\r", "\n") for t in texts]
+        return texts
+
+    def read_string_plus(self):
+        index = self.index
+        _, text, extra = self.take_strings(1)[0]
+        if extra == b"" and not self.strict:
+            return (self.decode(text, 0), "")
+        offset = self.get_offsets()[index]
+        return (self.decode(text, offset), self.decode(extra, offset + len(text) + 1))
+
+    def read_string_plus_num(self):
+        """Reads a string, and the number in the extra text after it."""
+        index = self.index
+        _, text, extra = self.take_strings(1)[0]
+        offset = self.get_offsets()[index]
+        extra_offset = offset + len(text) + 1
+        value_offset = extra_offset + len(extra) - len(extra.lstrip())
+        token = extra.strip()
+        try:
+            num = int(token)
+        except ValueError:
+            m = _leading_num_re.match(token)
+            if m is None:
+                raise DatError(value_offset, "expected a number")
+            if self.strict:
+                raise DatError(value_offset + m.end(), "unexpected text after number")
+            num = int(m.group())
+        return (self.decode(text, offset), num)
+
+    def read_string(self):
+        return self.read_strings(1)[0]
+
+    def read_strings(self, count):
+        """Reads 'count' strings at once, discarding any extra text after them."""
+        index = self.index
+        return self.decode_strings(self.take_strings(count), index)
+
+    def new_text_table(self):
+        return LazyTextTable(self.data, self.encoding) if self.lazy else []
+
+    def read_text_into(self, table):
+        """Reads a string and appends it to a table from new_text_table(). If lazy,
+        this appends only the string's location."""
+        self.read_texts_into(table, 1)
+
+    def read_texts_into(self, table, count):
+        """Reads 'count' strings, as read_text_into() does."""
+        index = self.index
+        strings = self.take_strings(count)
+        if not self.lazy:
+            table.extend(self.decode_strings(strings, index))
+            return
+
+        if self.strict:
+            self.decode_strings(strings, index)  # just for the error checking
+        offsets = self.get_offsets()
+        spans = []
+        for n, (gap, text, extra) in enumerate(strings):
+            start = offsets[index + n]
+            spans += (start, start + len(text))
+        table.extend_spans(spans)
+
+
+class DatError(ValueError):
+    """An error raised by DatReader when a file is malformed.
+
+    offset - the byte offset in the file where the problem is.
+    """
+
+    def __init__(self, offset, message):
+        ValueError.__init__(self, f"byte {offset}: {message}")
+        self.offset = offset
+
+
+class LazyTextTable:
+    """A list of strings in a DAT buffer, which records only where each is.
+
+    Each string is decoded when it is first used, and then kept in a small
+    LRU cache; most messages are never shown in a session, so they need never
+    be decoded at all.
+
+    data - the buffer (typically an mmap) holding the text; this is not pickled,
+           so you must set it again after unpickling.
+    encoding - the text encoding of the buffer
+    spans - array of start, end offsets of each string, flattened
+    cache_size - maximum number of decoded strings to keep
+    """
+
+    def __init__(self, data, encoding="utf-8", cache_size=64):
+        self.data = data
+        self.encoding = encoding
+        self.spans = array("Q")
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def __getstate__(self):
+        return {
+            "encoding": self.encoding,
+            "spans": self.spans,
+            "cache_size": self.cache_size,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.data = None
+        self.cache = OrderedDict()
+
+    def append_span(self, start, end):
+        """Adds a string, given its start and end offsets in the buffer."""
+        self.spans.append(start)
+        self.spans.append(end)
+
+    def extend_spans(self, spans):
+        """Adds strings, given their start and end offsets, flattened."""
+        self.spans.extend(spans)
+
+    def __len__(self):
+        return len(self.spans) // 2
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        try:
+            text = self.cache[index]
+            self.cache.move_to_end(index)
+            return text
+        except KeyError:
+            pass
+
+        if not 0 <= index < len(self):
+            raise IndexError(f"text index {index} out of range")
+
+        start = self.spans[index * 2]
+        end = self.spans[index * 2 + 1]
+        text = decode_text(self.data[start:end], self.encoding)
+        self.cache[index] = text
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return text
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def load_extracted(path, strict=False, lazy=True):
+    """Reads the DAT file at 'path' in one go, and returns its ExtractedFile.
+
+    If lazy, this keeps the file mapped into memory, and the room descriptions and
+    messages are read from it only when needed.
+    """
+    with open(path, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return ExtractedFile(DatReader(data, strict, lazy=lazy))
+    finally:
+        if not lazy:
+            data.close()
+
+
 # Utility Functions
 
 
@@ -179,11 +668,22 @@ def read_string(file):
     return read_string_plus(file)[0]
 
 
+def decode_text(raw, encoding, strict=False):
+    """Decodes bytes from a DAT file, translating line endings as a text file would."""
+    text = raw.decode(encoding, "strict" if strict else "replace")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
 def split_number(number, multiplier):
     """Decodes a number into two. The number = high * multiplier + low, and
     This method returns the tuple (high, low).
     """
 
+    if number >= 0:
+        return divmod(number, multiplier)
+
     low = int(number % multiplier)
     high = int(number / multiplier)
     return (high, low)
@@ -1,28 +1,62 @@
+import hashlib
 import re
+import struct
+import zlib
+from array import array
+from collections import OrderedDict, deque
 from execution import Occurance, Command, Continuation
+from state import GameState, FLAG_COUNT, INVENTORY, NOWHERE, DARK_FLAG, LAMP_EXHAUSTED_FLAG
 
+# Binary saved games start with this, and the version of their layout.
+SAVE_MAGIC = b"SDSAVE\0\0"
+SAVE_VERSION = 1
 
-class Game:
-    """This is the root object containing the game state.
+# magic, version, game fingerprint, CRC-32 of the state; the state follows.
+_save_header = "<8sH16sI"
+
+# The most tokens GameDefinition.enrich_word() remembers the matches of.
+WORD_MATCH_LIMIT = 4096
+
+# The most messages, and the most rooms, whose enriched words a
+# GameDefinition keeps; like LazyTextTable's decoded text, the rest are
+# enriched again when next used. This holds all of a typical game's.
+WORDS_CACHE_SIZE = 256
+
+# What the interactive front ends say when the game ends; only UNDO and
+# REDO are accepted after that.
+GAME_OVER_TEXT = "The game is over. Enter UNDO to take back your last move."
+
+
+class GameDefinition:
+    """This holds the parts of a game that do not change as it is played: the
+    map, the vocabulary, the items as they start out, and the logic. One
+    definition can be shared by any number of Game sessions.
 
     word_length - the length of Word object text
     rooms - list of Rooms (but not 'inventory')
-    inventory - a Room holding the player's inventory
-    player_room - the room the player is in
+    inventory - a Room standing for the player's inventory
+    noun_groups - a Word for each group of synonyms among the nouns, in the
+                  order of ExtractedFile.grouped_nouns
+    starting_room - the room the player starts in
     items - list of all Items
     messages - list of messages
-    flags - list of 32 Flags
-    counters - list of 16 counters
-    logics - list of all game logics
-
-    saved_player_room - a room the player was in
-    saved_player_rooms - a list of more rooms the player was in
+    occurances - the logics that run before each command
+    commands - the logics that handle commands, with their continuations
+    command_runs - maps the (verb, noun) of each command to it and its
+                   continuations; see group_commands()
+    command_index - maps (verb, noun) to the commands that might handle it;
+                    get_command_candidates() fills this in as it is used
+    occurance_mask - a bitmask with a bit for each occurance that is not a
+                     continuation, by position in occurances
+    occurances_by_item, occurances_by_flag, occurances_by_room,
+    occurances_by_counter, occurances_by_player_loc - bitmasks of the
+                    occurances whose conditions read each item's location (with
+                    an extra last entry for the inventory count), each flag,
+                    whether the player is in each room, the counter, and the
+                    player's location for any other reason
 
-    dark_flag - the flag (#15) that is set when it is dark
-    lamp_exhausted_flag - the flag (#16) set when lamp runs out
     lamp_item - the lamp (#9)
     light_duration - the initial light_remaining
-    light_remaining - number of turns of lamp use left
     max_carried - number of items the player can carry
     treasure_count - total number of treasures
     treasure_room - room where treasure must be placed
@@ -32,38 +66,26 @@ class Game:
     up_word, down_word,
     go_word, get_word, drop_word - predefined Word objects
     directions - a list of all direction words above
-
-    needs_room_update - set when the room look text needs to be reshown;
-                        you clear this once you have done so.
-    wants_room_update - set when the room has changed, but immediate
-                        redisplay is not needed. Again, clear this yourself.
-    game_over - set when the game is over and should exit
-
-    continuing_commands - set to continue executing actions, but only 'continuing' ones
+    word_matches - maps output tokens to the (noun, verb) that enrich_word()
+                   matched them with; it is cleared when it gets too big
+    message_words - an LRU cache of the words of recently used messages, by
+                    message number; see get_message_words()
+    room_words - an LRU cache of the static words of recently described rooms,
+                 by room index; see Room.get_static_words()
     """
 
     def __init__(self, extracted):
         self.word_length = extracted.word_length
+        self.message_words = OrderedDict()
+        self.room_words = OrderedDict()
         self.rooms = [Room(self, i, x) for i, x in enumerate(extracted.rooms)]
         self.inventory = Room(self, -1, description="Inventory")
-        self.player_room = self.rooms[extracted.starting_room]
-        self.saved_player_room = self.player_room
-        self.saved_player_rooms = [self.player_room for n in range(0, 16)]
-        self.needs_room_update = True
-        self.wants_room_update = True
-        self.game_over = False
-
-        self.counter = Counter()
-        self.counters = [Counter() for n in range(0, 16)]
-
-        self.flags = [Flag() for n in range(0, 32)]
-        self.dark_flag = self.flags[15]
-        self.lamp_exhausted_flag = self.flags[16]
+        self.starting_room = self.rooms[extracted.starting_room]
 
         self.nouns = dict()
-        for i, g in enumerate(extracted.grouped_nouns):
-            word = Word(g)
-            for text in g:
+        self.noun_groups = [Word(g) for g in extracted.grouped_nouns]
+        for word in self.noun_groups:
+            for text in word.aliases:
                 self.nouns[self.normalize_word(text)] = word
 
         self.north_word = self.get_noun("NORTH")
@@ -98,6 +120,7 @@ class Game:
         self.go_word = self.get_verb("GO")
         self.get_word = self.get_verb("GET")
         self.drop_word = self.get_verb("DROP")
+        self.word_matches = dict()
 
         for i, r in enumerate(self.rooms):
             src = extracted.rooms[i]
@@ -113,19 +136,17 @@ class Game:
             r.down = resolve_room(src.down)
 
         self.items = []
-        for ei in extracted.items:
-            item = Item(self, ei)
+        for i, ei in enumerate(extracted.items):
+            item = Item(self, i, ei)
             if ei.starting_room in (-1, 255):
-                item.starting_room = self.inventory
+                item.starting_loc = INVENTORY
             elif ei.starting_room == 0:
-                item.starting_room = None
+                item.starting_loc = NOWHERE
             else:
-                item.starting_room = self.rooms[ei.starting_room]
-            item.room = item.starting_room
+                item.starting_loc = self.rooms[ei.starting_room].index
             self.items.append(item)
         self.lamp_item = self.items[9]
         self.light_duration = extracted.light_duration
-        self.light_remaining = self.light_duration
         self.max_carried = extracted.max_carried
 
         self.treasure_room = self.rooms[extracted.treasure_room]
@@ -151,6 +172,30 @@ class Game:
                 self.commands.append(Command(self, extracted, ea))
                 continuing_action = True
 
+        # Each logic creates its functions when first used; we make them
+        # all now, so a bad opcode fails the load, unless this file is
+        # known to be good.
+        if not extracted.checked:
+            for logic in self.occurances + self.commands:
+                logic.create_functions()
+
+        self.command_runs = self.group_commands()
+        self.command_index = dict()
+        self.index_occurance_dependencies()
+        self.fingerprint = None
+        self.save_struct = None
+
+        if extracted.command_words is not None:
+            for item, indices in zip(self.items, extracted.command_words):
+                item.command_words = {self.noun_groups[i] for i in indices}
+        else:
+            self.assign_command_words()
+
+    def assign_command_words(self):
+        """Works out which nouns refer to each item, by matching the
+        vocabulary against item descriptions.
+        """
+
         # try to assign command-words where we can find 'em, so items
         # you can't carry can still be clicked.
         carry_words = {
@@ -183,29 +228,307 @@ class Game:
                 if noun is not None and noun not in self.directions and noun not in item.command_words:
                     item.command_words.add(noun)
 
-        self.output_words = []
+    def get_command_word_indices(self):
+        """Returns the command words of each item, as lists of indices into
+        noun_groups, in item order. This is the form in which
+        ExtractedFile.command_words caches them.
+        """
+        group_indices = {word: i for i, word in enumerate(self.noun_groups)}
+        return [[group_indices[w] for w in item.command_words] for item in self.items]
+
+    def group_commands(self):
+        """Builds the command_runs. Each command is taken with the continuations
+        that follow it, as these run only after it. We map the (verb, noun) of
+        each command to (position, run) pairs for those runs.
+        """
+
+        runs = dict()
+        run = None
+        for position, logic in enumerate(self.commands):
+            if logic.is_continuation:
+                if run is not None:
+                    run.append(logic)
+            else:
+                run = [logic]
+                runs.setdefault((logic.verb, logic.noun), []).append((position, run))
+        return runs
+
+    def index_commands(self, verb, noun):
+        """Returns the entry of the command_index for (verb, noun). This is the
+        runs for the commands that take that noun or any noun, or if none take
+        that noun, just those taking any noun; the runs stay in their original
+        order.
+        """
+        runs = self.command_runs
+        entries = runs.get((verb, noun))
+        if entries is None:
+            entries = runs.get((verb, None), [])
+        elif noun is not None:
+            entries = entries + runs.get((verb, None), [])
+            entries.sort(key=lambda entry: entry[0])
+        return [logic for _, run in entries for logic in run]
+
+    def index_occurance_dependencies(self):
+        """Builds the occurance_mask and occurances_by_ bitmasks, from what each
+        occurance's conditions read. Continuations are left out, as their
+        availability is not cached."""
+        self.occurance_mask = 0
+        self.occurances_by_item = [0] * (len(self.items) + 1)
+        self.occurances_by_flag = [0] * FLAG_COUNT
+        self.occurances_by_room = [0] * len(self.rooms)
+        self.occurances_by_counter = 0
+        self.occurances_by_player_loc = 0
+
+        for position, logic in enumerate(self.occurances):
+            if logic.is_continuation:
+                continue
+            bit = 1 << position
+            self.occurance_mask |= bit
+            for i in logic.reads_items:
+                if i < len(self.items):
+                    self.occurances_by_item[i] |= bit
+            if logic.reads_inventory:
+                self.occurances_by_item[-1] |= bit
+            for f in range(FLAG_COUNT):
+                if logic.reads_flags & (1 << f):
+                    self.occurances_by_flag[f] |= bit
+            for r in logic.reads_rooms:
+                if r < len(self.rooms):
+                    self.occurances_by_room[r] |= bit
+            if logic.reads_counter:
+                self.occurances_by_counter |= bit
+            if logic.reads_player_loc:
+                self.occurances_by_player_loc |= bit
+
+    def get_command_candidates(self, verb, noun):
+        """Returns the commands (and their continuations) that might handle the
+        user command indicated by verb and noun, in order."""
+        candidates = self.command_index.get((verb, noun))
+        if candidates is None:
+            candidates = self.index_commands(verb, noun)
+            self.command_index[(verb, noun)] = candidates
+        return candidates
 
     def enrich_word(self, token, excluded_nouns=None):
         """Creates an OutputWord for a token, enriching it with vocab matches."""
-        normalized = self.normalize_word(clean_word(token))
-        noun = self.nouns.get(normalized)
-        verb = self.verbs.get(normalized)
+        # The same text is output again and again, so we remember what each
+        # token matched.
+        matches = self.word_matches.get(token)
+        if matches is None:
+            normalized = self.normalize_word(clean_word(token))
+            verb = self.verbs.get(normalized)
+            if verb == self.go_word or verb == self.get_word or verb == self.drop_word:
+                verb = None
+            matches = (self.nouns.get(normalized), verb)
+            if len(self.word_matches) >= WORD_MATCH_LIMIT:
+                self.word_matches.clear()
+            self.word_matches[token] = matches
+
+        noun, verb = matches
         if noun is not None and (excluded_nouns is None or noun not in excluded_nouns):
             return OutputWord(token, vocab_noun=noun)
-        elif verb is not None and verb != self.go_word and verb != self.get_word and verb != self.drop_word:
+        elif verb is not None:
             return OutputWord(token, vocab_verb=verb)
         else:
             return OutputWord(token)
 
+    def get_message_words(self, number):
+        """Returns the words of a message, and a line break, as a tuple of
+        OutputWords. These are enriched on first use, and then shared by
+        every game while they stay cached, so don't modify them."""
+        words = self.get_cached_words(self.message_words, number)
+        if words is None:
+            words = tuple(self.enrich_word(part) for part in self.messages[number].split())
+            words += (_newline_word,)
+            self.cache_words(self.message_words, number, words)
+        return words
+
+    def get_cached_words(self, cache, key):
+        """Returns the words 'cache' holds for 'key', marking them as recently
+        used, or None if it has none."""
+        words = cache.get(key)
+        if words is not None:
+            cache.move_to_end(key)
+        return words
+
+    def cache_words(self, cache, key, words):
+        """Adds words to 'cache', discarding the least recently used words if
+        it holds more than WORDS_CACHE_SIZE."""
+        cache[key] = words
+        if len(cache) > WORDS_CACHE_SIZE:
+            cache.popitem(last=False)
+
+    def normalize_word(self, word):
+        """Converts the word to the the right length, and uppercase."""
+        return word[: self.word_length].upper()
+
+    def get_noun(self, text):
+        """Returns the Word for the text given; this will normalize text
+        and accounts for aliases. Returns None if text is None, but
+        raises ValueError if it is not a known noun, even if it is a verb.
+        """
+
+        if text is None:
+            return None
+        try:
+            return self.nouns[self.normalize_word(text)]
+        except KeyError:
+            raise ValueError(f"I don't know what '{text}' means.")
+
+    def get_fingerprint(self):
+        """Returns 16 bytes that identify this game by its layout: its map,
+        where its items start, and how many of each thing it has. Saved games
+        record this, so they can't be loaded into a different game."""
+        if self.fingerprint is None:
+            counts = (
+                self.word_length,
+                len(self.rooms),
+                len(self.items),
+                len(self.occurances),
+                len(self.commands),
+                len(self.verbs),
+                len(self.nouns),
+                len(self.messages),
+                self.starting_room.index,
+                self.treasure_room.index,
+                self.treasure_count,
+                self.light_duration,
+                self.max_carried,
+            )
+            exits = array("h")
+            for r in self.rooms:
+                for exit in (r.north, r.south, r.east, r.west, r.up, r.down):
+                    exits.append(-1 if exit is None else exit.index)
+            starting_locs = array("h", [i.starting_loc for i in self.items])
+
+            h = hashlib.blake2b(digest_size=16)
+            h.update(struct.pack(f"<{len(counts)}q", *counts))
+            h.update(exits.tobytes())
+            h.update(starting_locs.tobytes())
+            self.fingerprint = h.digest()
+        return self.fingerprint
+
+    def get_save_struct(self):
+        """Returns the struct.Struct of a binary saved game of this game; its
+        last field is the state snapshot, whose size depends on the game."""
+        if self.save_struct is None:
+            snapshot_size = len(GameState(self).snapshot())
+            self.save_struct = struct.Struct(f"{_save_header}{snapshot_size}s")
+        return self.save_struct
+
+    def get_room(self, loc):
+        """Returns the Room at a location; this is the inventory for INVENTORY,
+        and None for NOWHERE."""
+        if loc == INVENTORY:
+            return self.inventory
+        if loc == NOWHERE:
+            return None
+        return self.rooms[loc]
+
+    def get_verb(self, text):
+        """Returns the Word for the text given; this will normalize text
+        and accounts for aliases. Returns None if text is None, but
+        raises ValueError if it is not a known verb, even if it is a noun.
+        """
+
+        if text is None:
+            return None
+        try:
+            return self.verbs[self.normalize_word(text)]
+        except KeyError:
+            raise ValueError(f"I don't know what '{text}' means.")
+
+
+class Game:
+    """This is the root object for a game being played; it holds the shared
+    definition of the game and this session's state, and handles the input
+    and output.
+
+    definition - the GameDefinition being played; anything not found on
+                 the Game itself is looked up here, so game.items, game.verbs
+                 and so on work.
+    state - the GameState of this session
+
+    needs_room_update - set when the room look text needs to be reshown;
+                        you clear this once you have done so.
+    wants_room_update - set when the room has changed, but immediate
+                        redisplay is not needed. Again, clear this yourself.
+    game_over - set when the game is over and should exit
+    debug_checks - set to check the room contents index after each change;
+                   this is slow, and meant for debugging.
+    synchronous_logic - set to run logics in one step, without yielding to the
+                        event loop, unless they wait or save the game. Otherwise
+                        logics yield after each action.
+    wait_seconds - how long the wait opcode pauses
+    undo_limit - the most turns that can be undone
+    binary_saves - set to save games in the binary format, which is smaller and
+                   faster; otherwise they are saved as ScottFree text. Either
+                   can be loaded.
+
+    history - snapshots of the state taken before each command and each run of
+              occurances, as (before_command, snapshot) tuples; undo() uses it
+    redo_history - (snapshot, game_over) tuples for the state before each
+                   undo(), for redo()
+
+    continuing_commands - set to continue executing actions, but only 'continuing' ones
+
+    unchecked_occurances - a bitmask of the occurances, by position, whose
+                           conditions must be checked again before they run;
+                           see update_occurance_cache()
+    available_occurances - a bitmask of the other occurances whose conditions
+                           were met when last checked
+    cached_flags, cached_counter,
+    cached_player_loc - the state the masks above were last updated for
+    """
+
+    debug_checks = False
+    synchronous_logic = True
+    wait_seconds = 2.0
+    undo_limit = 100
+    binary_saves = True
+
+    def __init__(self, definition):
+        """Starts a game. 'definition' may be a GameDefinition to share, or an
+        ExtractedFile to build a new one from."""
+        if not isinstance(definition, GameDefinition):
+            definition = GameDefinition(definition)
+        self.definition = definition
+        self.state = GameState(definition)
+        self.needs_room_update = True
+        self.wants_room_update = True
+        self.game_over = False
+        self.output_words = []
+        # Two snapshots a turn: one before the occurances, one before the command.
+        self.history = deque(maxlen=self.undo_limit * 2)
+        self.redo_history = []
+
+        self.unchecked_occurances = definition.occurance_mask
+        self.available_occurances = 0
+        self.cached_flags = self.state.flags
+        self.cached_counter = self.state.counter
+        self.cached_player_loc = self.state.player_loc
+
+    def __getattr__(self, name):
+        # Only called for attributes the Game lacks; these come from
+        # the definition.
+        if name == "definition":
+            raise AttributeError(name)
+        return getattr(self.definition, name)
+
     def output(self, text):
         """Adds text to the output buffer, with no newline."""
         for part in text.split():
-            self.output_word(self.enrich_word(part))
+            self.output_word(self.definition.enrich_word(part))
 
     def output_line(self, line=""):
         """Adds text to the output buffer, followed by a newline."""
         self.output(line)
-        self.output_word(OutputWord("\n"))
+        self.output_word(_newline_word)
+
+    def output_message(self, number):
+        """Adds a message to the output buffer, followed by a newline, as
+        output_line() would; but the words are enriched only once."""
+        self.output_words.extend(self.definition.get_message_words(number))
 
     def output_word(self, word):
         """Adds a single OutputWord to the output buffer."""
@@ -231,10 +554,10 @@ class Game:
         """
 
         if word is not None:
+            state = self.state
             for i in self.items:
-                if (
-                    i.room == self.player_room or i.room == self.inventory
-                ) and i.carry_word == word:
+                loc = state.item_locs[i.index]
+                if (loc == state.player_loc or loc == INVENTORY) and i.carry_word == word:
                     return i
 
             for i in self.items:
@@ -250,10 +573,10 @@ class Game:
         """
 
         if word is not None:
+            state = self.state
             for i in self.items:
-                if (
-                    i.room == self.player_room or i.room == self.inventory
-                ) and i.command_word == word:
+                loc = state.item_locs[i.index]
+                if (loc == state.player_loc or loc == INVENTORY) and i.command_word == word:
                     return i
 
             for i in self.items:
@@ -261,36 +584,6 @@ class Game:
                     return i
         return None
 
-    def normalize_word(self, word):
-        """Converts the word to the the right length, and uppercase."""
-        return word[: self.word_length].upper()
-
-    def get_noun(self, text):
-        """Returns the Word for the text given; this will normalize text
-        and accounts for aliases. Returns None if text is None, but
-        raises ValueError if it is not a known noun, even if it is a verb.
-        """
-
-        if text is None:
-            return None
-        try:
-            return self.nouns[self.normalize_word(text)]
-        except KeyError:
-            raise ValueError(f"I don't know what '{text}' means.")
-
-    def get_verb(self, text):
-        """Returns the Word for the text given; this will normalize text
-        and accounts for aliases. Returns None if text is None, but
-        raises ValueError if it is not a known verb, even if it is a noun.
-        """
-
-        if text is None:
-            return None
-        try:
-            return self.verbs[self.normalize_word(text)]
-        except KeyError:
-            raise ValueError(f"I don't know what '{text}' means.")
-
     def parse_command(self, command):
         """Parses a two-word command into a verb Word and a noun Word.
         This returns a tuple (verb, noun); if one or the other word is missing
@@ -326,24 +619,129 @@ class Game:
         logic that handles events other that carrying out commands.
         """
 
-        if self.lamp_item.room is not None and self.light_remaining > 0 and self.light_duration >= 0:
-            self.light_remaining -= 1
-            if self.light_remaining <= 0:
-                self.lamp_exhausted_flag.state = True
-                self.lamp_item.room = None
+        self.record_history(False)
+        definition = self.definition
+        state = self.state
+        lamp_item = definition.lamp_item
+        if (
+            state.item_locs[lamp_item.index] != NOWHERE
+            and state.light_remaining > 0
+            and definition.light_duration >= 0
+        ):
+            state.light_remaining -= 1
+            if state.light_remaining <= 0:
+                state.set_flag(LAMP_EXHAUSTED_FLAG, True)
+                self.place_item(lamp_item, NOWHERE)
                 self.needs_room_update = True
 
         self.continuing_commands = False
 
-        for logic in self.occurances:
-            if self.continuing_commands:
-                if logic.is_continuation:
-                    if logic.is_available:
-                        await logic.execute()
-                else:
-                    self.continuing_commands = False
-            elif not logic.is_continuation and logic.check_occurance():
-                await logic.execute()
+        # Most occurances are blocked by conditions whose inputs have not
+        # changed since they were last checked. We visit only those that might
+        # be available, but in order, and roll the dice just as
+        # check_occurance() does.
+        occurances = definition.occurances
+        self.update_occurance_cache()
+        unchecked = self.unchecked_occurances
+        available = self.available_occurances
+        remaining = unchecked | available
+        while remaining != 0:
+            bit = remaining & -remaining
+            remaining ^= bit
+            position = bit.bit_length() - 1
+            logic = occurances[position]
+
+            if unchecked & bit:
+                unchecked ^= bit
+                if not logic.check_conditions(self):
+                    available &= ~bit
+                    continue
+                available |= bit
+
+            if logic.check_chance():
+                self.unchecked_occurances = unchecked
+                self.available_occurances = available
+                await self.execute_logic(logic)
+                self.update_occurance_cache()
+                if self.continuing_commands:
+                    position = await self.perform_continuations(occurances, position + 1)
+                    bit = 1 << position
+
+                # The logic may have changed what is available after it.
+                unchecked = self.unchecked_occurances
+                available = self.available_occurances
+                remaining = (unchecked | available) & ~((bit << 1) - 1)
+
+        self.unchecked_occurances = unchecked
+        self.available_occurances = available
+
+        if self.debug_checks:
+            self.check_occurance_cache()
+
+    async def perform_continuations(self, occurances, position):
+        """Runs the continuations that start at 'position' in 'occurances', as
+        far as the next logic that is not a continuation; this clears
+        continuing_commands there, and that logic does not run. Returns the
+        position of that logic."""
+        while position < len(occurances):
+            logic = occurances[position]
+            if not logic.is_continuation:
+                self.continuing_commands = False
+                break
+            if logic.is_available(self):
+                await self.execute_logic(logic)
+                self.update_occurance_cache()
+            position += 1
+        return position
+
+    def check_occurance_cache(self):
+        """Verifies that the availability of each occurance that is not marked
+        for checking is still right, and raises AssertionError if not."""
+        for position, logic in enumerate(self.definition.occurances):
+            bit = 1 << position
+            if self.definition.occurance_mask & ~self.unchecked_occurances & bit:
+                cached = self.available_occurances & bit != 0
+                if cached != logic.check_conditions(self):
+                    raise AssertionError(f"Occurance {position} availability is stale")
+
+    def update_occurance_cache(self):
+        """Marks for checking again the occurances whose conditions read state
+        that has changed since this was last called."""
+        definition = self.definition
+        state = self.state
+
+        changed_items = state.changed_items
+        if changed_items != 0:
+            state.changed_items = 0
+            if changed_items < 0:
+                self.unchecked_occurances = definition.occurance_mask
+            else:
+                by_item = definition.occurances_by_item
+                while changed_items != 0:
+                    bit = changed_items & -changed_items
+                    changed_items ^= bit
+                    self.unchecked_occurances |= by_item[bit.bit_length() - 1]
+
+        changed_flags = state.flags ^ self.cached_flags
+        if changed_flags != 0:
+            self.cached_flags = state.flags
+            by_flag = definition.occurances_by_flag
+            while changed_flags != 0:
+                bit = changed_flags & -changed_flags
+                changed_flags ^= bit
+                self.unchecked_occurances |= by_flag[bit.bit_length() - 1]
+
+        if state.counter != self.cached_counter:
+            self.cached_counter = state.counter
+            self.unchecked_occurances |= definition.occurances_by_counter
+
+        if state.player_loc != self.cached_player_loc:
+            by_room = definition.occurances_by_room
+            for loc in (self.cached_player_loc, state.player_loc):
+                if loc >= 0:
+                    self.unchecked_occurances |= by_room[loc]
+            self.cached_player_loc = state.player_loc
+            self.unchecked_occurances |= definition.occurances_by_player_loc
 
     async def perform_command(self, verb, noun):
         """Executes a command given. Either verb or noun can be None.
@@ -352,32 +750,36 @@ class Game:
         some default verbs.
         """
 
+        self.record_history(True)
+        definition = self.definition
         halted = await self.execute_command(
-            self.commands, lambda logic: logic.check_command(verb, noun)
+            definition.get_command_candidates(verb, noun),
+            lambda logic: logic.check_command(self, verb, noun),
         )
 
         if halted:
             return
 
-        if verb is None or verb == self.go_word:
-            next = self.player_room.get_move(noun)
+        state = self.state
+        if verb is None or verb == definition.go_word:
+            next = definition.get_room(state.player_loc).get_move(noun)
             if next is None:
                 raise WordError(noun, "I can't go there!")
-            self.move_player(next)
-        elif verb == self.get_word:
+            self.move_player(next.index)
+        elif verb == definition.get_word:
             item = self.get_carry_item(noun)
             if item is None:
                 raise WordError(noun, "I can't pick that up.")
-            if item.room == self.inventory:
+            if state.item_locs[item.index] == INVENTORY:
                 raise ValueError("I already have it.")
-            if item.room != self.player_room:
+            if state.item_locs[item.index] != state.player_loc:
                 raise ValueError("I don't see it here!")
 
             self.get_item(item)
             self.output_line("OK")
-        elif verb == self.drop_word:
+        elif verb == definition.drop_word:
             item = self.get_carry_item(noun)
-            if item is None or item.room != self.inventory:
+            if item is None or state.item_locs[item.index] != INVENTORY:
                 raise ValueError("I'm not carrying it!")
 
             self.drop_item(item)
@@ -385,6 +787,87 @@ class Game:
         else:
             raise ValueError("I don't understand.")
 
+    def record_history(self, before_command):
+        """Snapshots the state so undo() can return to it. This discards
+        anything redo() could have restored, as the game has moved on."""
+        self.history.append((before_command, self.state.snapshot()))
+        self.redo_history.clear()
+
+    def undo(self, turns=1):
+        """Puts the state back as it was before the last 'turns' commands;
+        commands that changed nothing are skipped over. Returns the number
+        of turns undone, which is less than 'turns' if the history runs out."""
+        current = self.state.snapshot()
+        # The move that ended the game may have changed nothing else, but
+        # it still counts.
+        target = None if self.game_over else current
+        undone = 0
+        while undone < turns and len(self.history) > 0:
+            before_command, snapshot = self.history.pop()
+            if before_command and snapshot != target:
+                target = snapshot
+                undone += 1
+
+        if undone > 0:
+            self.redo_history.append((current, self.game_over))
+            self.restore_snapshot(target)
+        return undone
+
+    def redo(self):
+        """Reverses the last undo(); returns False if there is none to reverse."""
+        if len(self.redo_history) == 0:
+            return False
+
+        self.history.append((True, self.state.snapshot()))
+        snapshot, game_over = self.redo_history.pop()
+        self.restore_snapshot(snapshot)
+        self.game_over = game_over
+        return True
+
+    def restore_snapshot(self, snapshot):
+        """Puts the state back as it was when 'snapshot' was taken."""
+        self.state.restore(snapshot)
+        self.game_over = False
+        self.needs_room_update = True
+        self.wants_room_update = True
+
+        if self.debug_checks:
+            self.check_item_index()
+
+    def parse_undo_command(self, command):
+        """Parses UNDO, UNDO <turns> or REDO. This returns a tuple of the
+        verb and the number of turns, or None if 'command' is anything else."""
+        parts = command.upper().split()
+        if parts == ["REDO"]:
+            return ("REDO", 1)
+        if len(parts) == 1 and parts[0] == "UNDO":
+            return ("UNDO", 1)
+        if len(parts) == 2 and parts[0] == "UNDO" and parts[1].isdigit():
+            return ("UNDO", int(parts[1]))
+        return None
+
+    def perform_undo_command(self, command):
+        """Carries out UNDO, UNDO <turns> or REDO, and returns True; for any
+        other command, does nothing and returns False. These commands belong to
+        the driver, not the game, so they don't run occurances afterwards."""
+        parsed = self.parse_undo_command(command)
+        if parsed is None:
+            return False
+
+        verb, turns = parsed
+        if verb == "REDO":
+            self.output_line("OK" if self.redo() else "There's nothing to redo.")
+            return True
+
+        undone = self.undo(turns)
+        if undone == 0:
+            self.output_line("There's nothing to undo.")
+        elif undone < turns:
+            self.output_line(f"I could only undo {undone} of those turns.")
+        else:
+            self.output_line("OK")
+        return True
+
     async def execute_command(self, logics, checker):
         """
         This executes a list of logics, as permitted by its conditions. Logics
@@ -399,24 +882,35 @@ class Game:
         for logic in logics:
             if self.continuing_commands:
                 if logic.is_continuation:
-                    if logic.is_available:
-                        await logic.execute()
+                    if logic.is_available(self):
+                        await self.execute_logic(logic)
                         halted = True
                 else:
                     break
             elif checker(logic):
-                await logic.execute()
+                await self.execute_logic(logic)
                 halted = True
                 if not self.continuing_commands:
                     break
 
         return halted
 
-    def check_score(self):
+    async def execute_logic(self, logic):
+        """Runs the actions of a logic; if possible, this does so without suspending."""
+        if self.synchronous_logic and not logic.is_async:
+            logic.execute_now(self)
+        else:
+            await logic.execute(self)
+
+    def get_score(self):
+        """Returns a tuple of the number of treasures stored, and the score out of 100."""
         treasures_found = sum(
-            1 for t in self.treasure_room.get_items() if t.is_treasure
+            1 for t in self.state.get_items(self.treasure_room.index) if t.is_treasure
         )
-        score = int(treasures_found * 100 / self.treasure_count)
+        return (treasures_found, int(treasures_found * 100 / self.treasure_count))
+
+    def check_score(self):
+        treasures_found, score = self.get_score()
         self.output_line(f"I stored {treasures_found} treasures.")
         self.output_line(f"On a scale of 0-100, that's: {score}")
         if score == 100:
@@ -424,24 +918,28 @@ class Game:
 
     def get_inventory_words(self):
         """Returns the text to display when the user takes inventory."""
-        words = [OutputWord(s) for s in "I am carrying the following:".split()]
-        items = self.inventory.get_items()
+        words = list(_carrying_words)
+        items = self.state.get_items(INVENTORY)
         if len(items) > 0:
-            words.append(OutputWord("\n"))
+            words.append(_newline_word)
             for item in items:
                 words.append(item.inventory_word)
         else:
-            words.append(OutputWord("Nothing at all!"))
+            words.append(_nothing_word)
         return words
 
+    def get_look_words(self):
+        """Returns the text describing the room the player is in."""
+        return self.definition.get_room(self.state.player_loc).get_look_words(self)
+
     def output_inventory_text(self):
         for word in self.get_inventory_words():
             self.output_word(word)
         self.output_line()
 
-    def move_player(self, new_room):
-        """Moves the player to a new room."""
-        self.player_room = new_room
+    def move_player(self, loc):
+        """Moves the player to a new location."""
+        self.state.player_loc = loc
         self.needs_room_update = True
 
     def get_item(self, item, force=False):
@@ -450,60 +948,97 @@ class Game:
         If force is true, this will work even if the player inventory is full.
         """
 
-        if not force and len(self.inventory.get_items()) >= self.max_carried:
+        if not force and self.state.get_item_count(INVENTORY) >= self.max_carried:
             raise ValueError("I've too much to carry!")
 
-        item.room = self.inventory
+        self.place_item(item, INVENTORY)
         self.wants_room_update = True
 
     def drop_item(self, item):
         """Cause an item to enter the room the player is in."""
-        item.room = self.player_room
+        self.place_item(item, self.state.player_loc)
         self.wants_room_update = True
 
-    def move_item(self, item, room):
-        """Moves an item to a particular room. The room may be None."""
-        item.room = room
+    def move_item(self, item, loc):
+        """Moves an item to a particular location, which may be NOWHERE."""
+        self.place_item(item, loc)
         self.wants_room_update = True
 
     def swap_items(self, item1, item2):
         """Swaps two items, so each winds up ine the room the other was in."""
-        tmp = item1.room
-        item1.room = item2.room
-        item2.room = tmp
+        item_locs = self.state.item_locs
+        tmp = item_locs[item1.index]
+        self.place_item(item1, item_locs[item2.index])
+        self.place_item(item2, tmp)
         self.wants_room_update = True
 
-    async def save_game(self):
-        """Saves the game to the file named using the ScottFree format."""
-
-        def get_room_index(r):
-            return 0 if r is None else r.index
+    def place_item(self, item, loc):
+        """Sets the location of an item, and updates the rooms' contents to match.
+        Everything that moves an item must go through here."""
+        self.state.place_item(item, loc)
+
+        if self.debug_checks:
+            self.check_item_index()
+
+    def check_item_index(self):
+        """Verifies that the contents of each room match the items that are in it,
+        and raises AssertionError if not."""
+        state = self.state
+        for room in self.rooms + [self.inventory]:
+            expected = [i for i in self.items if state.item_locs[i.index] == room.index]
+            contents = state.get_items(room.index)
+            if contents != expected:
+                raise AssertionError(
+                    f"Room {room.index} contains {contents}, not {expected}"
+                )
 
+    async def save_game(self):
+        """Saves the game to the file named; this uses the binary format
+        if binary_saves is set, and the ScottFree text format if not."""
         path = await self.get_save_game_path()
         if path is None:
             return
 
-        with open(path, "w") as file:
-            # counters (and saved rooms)
-            for n in range(0, 16):
-                file.write(
-                    f"{self.counters[n].value} {get_room_index(self.saved_player_rooms[n])}\n"
-                )
+        if self.binary_saves:
+            with open(path, "wb") as file:
+                file.write(self.get_save_data())
+        else:
+            with open(path, "w") as file:
+                self.write_text_save(file)
+
+    def get_save_data(self):
+        """Returns the state of the game in the binary saved game format."""
+        snapshot = self.state.snapshot()
+        return self.definition.get_save_struct().pack(
+            SAVE_MAGIC,
+            SAVE_VERSION,
+            self.definition.get_fingerprint(),
+            zlib.crc32(snapshot),
+            snapshot,
+        )
 
-            bitflags = 0
-            for f in reversed(self.flags):
-                bitflags = bitflags << 1
-                if f.state:
-                    bitflags = bitflags | 1
-            dark = 1 if self.dark_flag.state else 0
-            player_room_index = get_room_index(self.player_room)
+    def write_text_save(self, file):
+        """Writes the state of the game to a text file, in the ScottFree format."""
 
+        def get_room_index(loc):
+            return 0 if loc == NOWHERE else loc
+
+        state = self.state
+        # counters (and saved rooms)
+        for n in range(0, 16):
             file.write(
-                f"{bitflags} {dark} {player_room_index} {self.counter.value} {get_room_index(self.saved_player_room)} {self.light_remaining}\n"
+                f"{state.counters[n]} {get_room_index(state.saved_player_locs[n])}\n"
             )
 
-            for item in self.items:
-                file.write(f"{get_room_index(item.room)}\n")
+        dark = 1 if state.get_flag(DARK_FLAG) else 0
+        player_room_index = get_room_index(state.player_loc)
+
+        file.write(
+            f"{state.flags} {dark} {player_room_index} {state.counter} {get_room_index(state.saved_player_loc)} {state.light_remaining}\n"
+        )
+
+        for loc in state.item_locs:
+            file.write(f"{get_room_index(loc)}\n")
 
     async def get_save_game_path(self):
         """Provides the path to the file when saving the game; can return None to cancel."""
@@ -511,52 +1046,139 @@ class Game:
 
     async def load_game(self):
         """
-        Loads the game from the file named, which is in the ScottFree format.
-        Returns True if the game was loaded, and False if this was cancelled.
+        Loads the game from the file named, which may be in the binary format
+        or the ScottFree text format.
+        Returns True if the game was loaded, and False if this was cancelled;
+        once loaded, there is nothing to undo or redo.
+        Raises ValueError if the file is not a saved game of this game, and
+        OSError if it can't be read; the game is then left as it was.
         """
 
-        def find_room(index):
-            if index in (-1, 255):
-                return self.inventory
-            elif index == 0:
-                return None
-            else:
-                return self.rooms[index]
-
         path = await self.get_load_game_path()
         if path is None:
             return False
 
-        with open(path, "r") as file:
-            # counters and saved rooms
-            for n in range(0, 16):
-                line = file.readline().split()
-                self.counters[n].value = int(line[0])
-                self.saved_player_rooms[n] = find_room(int(line[1]))
-
-            state = file.readline().split()
-            bitflags = int(state[0])
-            for f in self.flags:
-                f.state = (bitflags & 1) != 0
-                bitflags = bitflags >> 1
-
-            self.player_room = find_room(int(state[2]))
-            self.counter.value = int(state[3])
-            self.saved_player_room = find_room(int(state[4]))
-            self.light_remaining = int(state[5])
-
-            for item in self.items:
-                item.room = find_room(int(file.readline()))
+        with open(path, "rb") as file:
+            data = file.read()
 
+        # A damaged text save can fail part way through.
+        snapshot = self.state.snapshot()
+        try:
+            if data.startswith(SAVE_MAGIC):
+                self.load_save_data(data)
+            else:
+                self.read_text_save(data.decode("utf-8").splitlines())
+        except (ValueError, OverflowError):
+            self.state.restore(snapshot)
+            raise
+
+        # The history is of the game we were playing, not the one loaded.
+        self.history.clear()
+        self.redo_history.clear()
         self.game_over = False
         self.needs_room_update = True
         return True
 
+    def load_save_data(self, data):
+        """Restores the state of the game from get_save_data()'s bytes. Raises
+        ValueError if they are damaged, or are from a different game."""
+        save_struct = self.definition.get_save_struct()
+        if len(data) != save_struct.size:
+            raise ValueError("This saved game is damaged or from a different game.")
+
+        magic, version, fingerprint, crc, snapshot = save_struct.unpack(data)
+        if magic != SAVE_MAGIC or version != SAVE_VERSION:
+            raise ValueError("This saved game is from a different version.")
+        if fingerprint != self.definition.get_fingerprint():
+            raise ValueError("This saved game is from a different game.")
+        if crc != zlib.crc32(snapshot):
+            raise ValueError("This saved game is damaged.")
+
+        self.state.restore(snapshot)
+        if self.debug_checks:
+            self.check_item_index()
+
+    def read_text_save(self, lines):
+        """Restores the state of the game from the lines of a ScottFree text
+        saved game. Raises ValueError if they are damaged."""
+        try:
+            self.read_text_save_lines(lines)
+        except (IndexError, ValueError, OverflowError):
+            raise ValueError("This saved game is damaged.")
+
+    def read_text_save_lines(self, lines):
+        """Implements read_text_save(), which turns the errors that damaged lines
+        cause into ValueError."""
+
+        def find_room(index):
+            if index in (-1, 255):
+                return INVENTORY
+            elif index == 0:
+                return NOWHERE
+            elif 0 < index < len(self.rooms):
+                return self.rooms[index].index
+            else:
+                raise ValueError(f"There is no room {index}.")
+
+        def read_count(text):
+            # counts are kept as 64-bit integers
+            value = int(text)
+            if not -(1 << 63) <= value < 1 << 63:
+                raise ValueError(f"{value} is out of range.")
+            return value
+
+        # Each item has a line; a save with fewer is cut short, or from
+        # another game.
+        if len(lines) < 17 + len(self.items):
+            raise ValueError("This saved game is damaged.")
+
+        state = self.state
+        # counters and saved rooms
+        for n in range(0, 16):
+            line = lines[n].split()
+            state.counters[n] = read_count(line[0])
+            state.saved_player_locs[n] = find_room(int(line[1]))
+
+        fields = lines[16].split()
+        state.flags = int(fields[0]) & ((1 << FLAG_COUNT) - 1)
+        state.player_loc = find_room(int(fields[2]))
+        state.counter = read_count(fields[3])
+        state.saved_player_loc = find_room(int(fields[4]))
+        state.light_remaining = read_count(fields[5])
+
+        for item, line in zip(self.items, lines[17:]):
+            self.place_item(item, find_room(int(line)))
+
     async def get_load_game_path(self):
         """Provides the path to the file when loading the game; can return None to cancel."""
         return "scott.sav"
 
 
+def words_to_text(words):
+    """Renders a sequence of OutputWords as plain text, laid out as the game
+    window does: words separated by spaces, and leading and trailing line breaks
+    dropped."""
+    words = list(words)
+    while len(words) > 0 and words[0].is_newline:
+        del words[0]
+
+    while len(words) > 0 and words[-1].is_newline:
+        del words[-1]
+
+    parts = []
+    word_index = 0
+    for word in words:
+        if word_index > 0:
+            parts.append(" ")
+        parts.append(str(word))
+
+        if word.is_newline:
+            word_index = 0
+        else:
+            word_index += 1
+    return "".join(parts)
+
+
 class Word:
     """Represents a word in the vocabulary; these are interned, so duplicate
     word objects do not exist.
@@ -591,33 +1213,30 @@ class WordError(Exception):
 class GameObject:
     """A base class for things in the game that you can see.
 
-    game - the game this object is part of
+    definition - the GameDefinition this object is part of
     description - the text displayed for this object
     """
 
-    def __init__(self, game, description):
-        self.game = game
+    def __init__(self, definition, description):
+        self.definition = definition
         self.description = description
 
 
 class Room(GameObject):
     """Represents a room in the game, with references to its neighboring rooms.
-    Rooms do not change during gameplay.
+    Rooms do not change during gameplay; the items in them are part of the
+    GameState.
 
     index - room number, used to save game
     north, south, east, west, up, down - refernces to neighboring rooms
+    extracted_room - the ExtractedRoom this room's description comes from
     """
 
-    def __init__(self, game, index, extracted_room=None, description=None):
-        if description is None and extracted_room is not None:
-            description = extracted_room.description
-            if description.startswith("*"):
-                description = description[1:]
-            else:
-                description = "I'm in a " + description
-
-        GameObject.__init__(self, game, description)
+    def __init__(self, definition, index, extracted_room=None, description=None):
+        # the description setter needs the index
         self.index = index
+        GameObject.__init__(self, definition, description)
+        self.extracted_room = extracted_room
         self.north = None
         self.south = None
         self.east = None
@@ -625,12 +1244,30 @@ class Room(GameObject):
         self.up = None
         self.down = None
 
+    @property
+    def description(self):
+        # The extracted text may be decoded only on demand, so we
+        # don't hang on to it.
+        if self.extracted_room is None:
+            return self.fixed_description
+
+        description = self.extracted_room.description
+        if description.startswith("*"):
+            return description[1:]
+        else:
+            return "I'm in a " + description
+
+    @description.setter
+    def description(self, value):
+        self.fixed_description = value
+        self.definition.room_words.pop(self.index, None)
+
     def __repr__(self):
         return self.description[:32]
 
-    def get_items(self):
-        """Returns a list of items that are in this room."""
-        return [i for i in self.game.items if i.room == self]
+    def get_items(self, game):
+        """Returns a list of items that are in this room, in the game given."""
+        return game.state.get_items(self.index)
 
     def get_move(self, word):
         """Returns the neighboring room in the direction indicated by the Word given.
@@ -638,13 +1275,14 @@ class Room(GameObject):
         Raises WordError if the word is invalid, but None if there's no neighbor that way.
         """
 
+        definition = self.definition
         choices = {
-            self.game.north_word: self.north,
-            self.game.south_word: self.south,
-            self.game.east_word: self.east,
-            self.game.west_word: self.west,
-            self.game.up_word: self.up,
-            self.game.down_word: self.down,
+            definition.north_word: self.north,
+            definition.south_word: self.south,
+            definition.east_word: self.east,
+            definition.west_word: self.west,
+            definition.up_word: self.up,
+            definition.down_word: self.down,
         }
 
         try:
@@ -652,66 +1290,95 @@ class Room(GameObject):
         except KeyError:
             raise WordError(word, f"'{word}' is not a direction.")
 
-    def get_look_words(self):
-        """The text to describe the room and everything in it."""
+    def get_look_words(self, game):
+        """The text to describe the room and everything in it, in the game given."""
 
+        definition = self.definition
+        state = game.state
         if (
-            self.game.dark_flag.state
-            and self.game.lamp_item.room != self.game.inventory
+            state.get_flag(DARK_FLAG)
+            and state.item_locs[definition.lamp_item.index] != INVENTORY
         ):
-            return [OutputWord("It is too dark to see!")]
-
-        items = self.get_items()
+            return [_too_dark_word]
 
-        # Collect nouns already covered by visible items or exits
-        covered_nouns = set()
-        for item in items:
-            for w in item.command_words:
-                covered_nouns.add(w)
-        for d in self.game.directions:
-            covered_nouns.add(d)
-
-        words = []
-        for token in self.description.split():
-            words.append(self.game.enrich_word(token, covered_nouns))
+        description_words, noun_fallbacks, exit_words = self.get_static_words()
+        words = list(description_words)
+        items = state.get_items(self.index)
         if len(items) > 0:
-            words.append(OutputWord("\n"))
-            words.append(OutputWord("\n"))
-            words.append(OutputWord("Visible items:"))
-
+            # Nouns the visible items cover aren't offered in the description.
+            covered_nouns = set()
+            for item in items:
+                covered_nouns.update(item.command_words)
+            for position, fallback in noun_fallbacks:
+                if words[position].vocab_noun in covered_nouns:
+                    words[position] = fallback
+
+            words.append(_newline_word)
+            words.append(_newline_word)
+            words.append(_visible_items_word)
             for item in items:
                 words.append(item.room_word)
 
-        exits = []
-        if self.north:
-            exits.append(OutputWord("North", direction=self.north))
-        if self.south:
-            exits.append(OutputWord("South", direction=self.south))
-        if self.east:
-            exits.append(OutputWord("East", direction=self.east))
-        if self.west:
-            exits.append(OutputWord("West", direction=self.west))
-        if self.up:
-            exits.append(OutputWord("Up", direction=self.up))
-        if self.down:
-            exits.append(OutputWord("Down", direction=self.down))
-
-        if len(exits) > 0:
-            words.append(OutputWord("\n"))
-            words.append(OutputWord("\n"))
-            words.append(OutputWord("Obvious exits:"))
-
-            for exit in exits:
-                words.append(exit)
-
+        words.extend(exit_words)
         return words
 
+    def get_static_words(self):
+        """Returns the parts of get_look_words() that don't depend on the
+        state of the game, enriched on first use and then reused while the
+        definition keeps them in room_words:
+
+        description_words - a tuple of the words of the description. The
+                            directions are left out of the nouns they match,
+                            as the exits cover them.
+        noun_fallbacks - a tuple of (position, word) for each description
+                         word that matches a noun, giving the word to use
+                         in its place if an item in the room covers the noun
+        exit_words - a tuple of the words that list the exits, or an empty
+                     tuple if there are none
+        """
+        definition = self.definition
+        static_words = definition.get_cached_words(definition.room_words, self.index)
+        if static_words is None:
+            directions = set(definition.directions)
+            description_words = []
+            noun_fallbacks = []
+            for position, token in enumerate(self.description.split()):
+                word = definition.enrich_word(token, directions)
+                if word.vocab_noun is not None:
+                    fallback = definition.enrich_word(token, (word.vocab_noun,))
+                    noun_fallbacks.append((position, fallback))
+                description_words.append(word)
+
+            exits = []
+            if self.north:
+                exits.append(OutputWord("North", direction=self.north))
+            if self.south:
+                exits.append(OutputWord("South", direction=self.south))
+            if self.east:
+                exits.append(OutputWord("East", direction=self.east))
+            if self.west:
+                exits.append(OutputWord("West", direction=self.west))
+            if self.up:
+                exits.append(OutputWord("Up", direction=self.up))
+            if self.down:
+                exits.append(OutputWord("Down", direction=self.down))
+
+            exit_words = ()
+            if len(exits) > 0:
+                exit_words = (_newline_word, _newline_word, _obvious_exits_word)
+                exit_words += tuple(exits)
+
+            static_words = (tuple(description_words), tuple(noun_fallbacks), exit_words)
+            definition.cache_words(definition.room_words, self.index, static_words)
+        return static_words
+
 
 class Item(GameObject):
     """Represents an item that can be moved from room to room.
 
-    room - the room the item is in.
-    starting_room - the room the item started in
+    index - item number, used to save game; GameState.item_locs holds the
+            location of the item, at this index.
+    starting_loc - the location the item started in
     carry_word - word used to get or drop the item;
                  None if the item can't be taken.
     command_words - word used to refer to this item by commands
@@ -719,11 +1386,11 @@ class Item(GameObject):
     inventory_word - output word output for the inventory
     """
 
-    def __init__(self, game, extracted_item):
-        GameObject.__init__(self, game, extracted_item.description)
-        self.carry_word = game.get_noun(extracted_item.carry_word)
+    def __init__(self, definition, index, extracted_item):
+        GameObject.__init__(self, definition, extracted_item.description)
+        self.index = index
+        self.carry_word = definition.get_noun(extracted_item.carry_word)
         self.command_words = {self.carry_word} if self.carry_word is not None else set()
-        self.room = None
         output_word = OutputWord(self.description, item=self)
         self.room_word = output_word
         self.inventory_word = output_word
@@ -750,21 +1417,6 @@ class Item(GameObject):
         return None
 
 
-class Flag:
-    def __init__(self):
-        self.state = False
-
-
-class Counter:
-    def __init__(self):
-        self.value = 0
-
-    def swap(self, game):
-        tmp = game.counter.value
-        game.counter.value = self.value
-        self.value = tmp
-
-
 _clean_word_re = re.compile(r'^[^a-zA-Z0-9]*(.*?)[^a-zA-Z0-9]*$')
 
 
@@ -774,13 +1426,27 @@ def clean_word(text):
 
 
 class OutputWord:
+    """A word of output text, with what it refers to, if anything. Words
+    for fixed text, like messages and room descriptions, are made once and
+    shared by every game, and every view that shows them; so nothing about
+    where a word is displayed belongs here.
+
+    text - the text to display
+    item - the Item the word names, or None
+    direction - the direction Word this word names, or None
+    vocab_noun, vocab_verb - the vocabulary Words this matches, or None
+    commands_version - the state version the cached commands are for
+    commands - the cached result of active_commands()
+    """
+
     def __init__(self, text, item=None, direction=None, vocab_noun=None, vocab_verb=None):
         self.text = text
         self.item = item
         self.direction = direction
         self.vocab_noun = vocab_noun
         self.vocab_verb = vocab_verb
-        self.tags = {}
+        self.commands_version = None
+        self.commands = None
 
     def is_plain(self, game):
         return len(self.active_commands(game)) == 0
@@ -788,21 +1454,32 @@ class OutputWord:
     def active_commands(self, game):
         """
         Returns a list of commands this word can trigger, which
-        may be empty for a 'plain' word.
+        may be empty for a 'plain' word. The list is cached until the game
+        state changes, so don't modify it.
         """
+        # Words like an item's inventory_word are shared between games; but
+        # no two states have the same version, so the cache can't confuse them.
+        version = game.state.get_version()
+        if self.commands_version != version:
+            self.commands = self.find_commands(game)
+            self.commands_version = version
+        return self.commands
+
+    def find_commands(self, game):
+        """Implements active_commands, without the caching."""
         if self.item is not None:
             commands = []
             for command_word in self.item.command_words:
                 command_name = self.item.get_command_name(command_word)
 
                 if self.item.carry_word is not None:
-                    if self.item.room == game.inventory:
+                    if game.state.item_locs[self.item.index] == INVENTORY:
                         commands.append("DROP " + command_name)
                     else:
                         commands.append("GET " + command_name)
 
                 for cmd in game.commands:
-                    if cmd.check_available_noun(command_word):
+                    if cmd.check_available_noun(game, command_word):
                         command = str(cmd.verb) + " " + command_name
                         if command not in commands:
                             commands.append(command)
@@ -814,7 +1491,7 @@ class OutputWord:
             clean = clean_word(self.text).upper()
             commands = []
             for cmd in game.commands:
-                if cmd.check_available_noun(self.vocab_noun):
+                if cmd.check_available_noun(game, self.vocab_noun):
                     command = str(cmd.verb) + " " + clean
                     if command not in commands:
                         commands.append(command)
@@ -823,7 +1500,7 @@ class OutputWord:
             clean = clean_word(self.text).upper()
             commands = []
             for cmd in game.commands:
-                if cmd.check_available_verb(self.vocab_verb):
+                if cmd.check_available_verb(game, self.vocab_verb):
                     commands.append(clean)
                     break
             return commands
@@ -836,3 +1513,12 @@ class OutputWord:
 
     def __str__(self):
         return self.text
+
+
+# Words that are output often, shared by every game.
+_newline_word = OutputWord("\n")
+_too_dark_word = OutputWord("It is too dark to see!")
+_visible_items_word = OutputWord("Visible items:")
+_obvious_exits_word = OutputWord("Obvious exits:")
+_carrying_words = tuple(OutputWord(s) for s in "I am carrying the following:".split())
+_nothing_word = OutputWord("Nothing at all!")
@@ -2,8 +2,22 @@ import asyncio
 
 from gi.repository import GLib, Gio
 
+try:
+    from gi.events import GLibEventLoopPolicy
+except ImportError:
+    GLibEventLoopPolicy = None  # PyGObject before 3.50
+
 
 def run(initializer_coro):
+    """Runs an asyncio event loop that also dispatches GLib's events, and
+    starts the application in it with 'initializer_coro'. This returns once
+    the loop is stopped.
+
+    With PyGObject 3.50 or later, asyncio runs on GLib's main loop, so the
+    two wait on the same file descriptors, and wake only when one is ready.
+    Older versions can't do this, so we fall back to polling GLib from
+    asyncio."""
+
     def on_activate(*args):
         loop.create_task(initializer_coro)
 
@@ -18,8 +32,14 @@ def run(initializer_coro):
             main_context.iteration(False)
         loop.call_later(0.01, repeated_iteration)
 
-    loop = asyncio.new_event_loop()
-    main_context = GLib.MainContext.default()
-    loop.create_task(start_application())
-    repeated_iteration()
-    loop.run_forever()
+    if GLibEventLoopPolicy is not None:
+        asyncio.set_event_loop_policy(GLibEventLoopPolicy())
+        loop = asyncio.get_event_loop_policy().get_event_loop()
+        loop.create_task(start_application())
+        loop.run_forever()
+    else:
+        loop = asyncio.new_event_loop()
+        main_context = GLib.MainContext.default()
+        loop.create_task(start_application())
+        repeated_iteration()
+        loop.run_forever()
@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+"""Plays a game without a display, taking commands from a file or stdin.
+
+The game's output is written to stdout as it happens, and the number of
+turns per second is reported on stderr at the end. This is for regression
+walkthroughs and load tests.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from contextlib import ExitStack
+from random import seed
+
+from cache import load_game
+from compilation import compile_logics
+from game import Game, WordError, words_to_text
+
+
+class HeadlessGame(Game):
+    """This game subclass writes its output to a text stream."""
+
+    def __init__(self, extracted_game, out):
+        Game.__init__(self, extracted_game)
+        self.out = out
+
+    def flush_output(self):
+        text = words_to_text(self.extract_output())
+        if text != "":
+            self.out.write(text + "\n")
+
+        if self.needs_room_update:
+            text = words_to_text(self.get_look_words())
+            self.out.write(text + "\n")
+        self.needs_room_update = False
+        self.wants_room_update = False
+        self.out.flush()
+
+
+async def play(game, commands):
+    """Plays the commands (an iterable of lines) until they run out or the game
+    ends. Once it has ended, UNDO and REDO are still carried out, and can take
+    back the move that ended it; any other command stops the play. Returns the
+    number of turns played."""
+
+    async def before_turn():
+        try:
+            await game.perform_occurances()
+        except (ValueError, WordError) as e:
+            game.output(str(e))
+        game.flush_output()
+
+    turns = 0
+    await before_turn()
+    for line in commands:
+        cmd = line.strip()
+        if cmd == "":
+            continue
+
+        if game.parse_undo_command(cmd) is not None:
+            game.output_line("> " + cmd)
+            game.perform_undo_command(cmd)
+            game.flush_output()
+            continue
+
+        if game.game_over:
+            break
+
+        # The command is echoed first, so the transcript shows it even if
+        # it can't be parsed.
+        game.output_line("> " + cmd)
+        try:
+            verb, noun = game.parse_command(cmd)
+            await game.perform_command(verb, noun)
+        except (ValueError, WordError) as e:
+            game.output(str(e))
+        game.flush_output()
+        turns += 1
+
+        if not game.game_over:
+            await before_turn()
+    return turns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("game_file")
+    parser.add_argument(
+        "commands", nargs="?", help="file of commands, one per line; default stdin"
+    )
+    parser.add_argument("--seed", type=int, help="random seed, for repeatable runs")
+    parser.add_argument("--no-wait", action="store_true", help="don't pause for waits")
+    parser.add_argument("--compile", action="store_true", help="compile game logic")
+    parser.add_argument("--quiet", action="store_true", help="discard game output")
+    parser.add_argument("--debug", action="store_true", help="check game state as it changes")
+    args = parser.parse_args()
+
+    seed(args.seed)
+    with ExitStack() as stack:
+        out = stack.enter_context(open(os.devnull, "w")) if args.quiet else sys.stdout
+        game = load_game(args.game_file, lambda extracted: HeadlessGame(extracted, out))
+        game.debug_checks = args.debug
+        if args.no_wait:
+            game.wait_seconds = 0.0
+        if args.compile:
+            compile_logics(game.definition)
+
+        if args.commands is None:
+            commands = sys.stdin
+        else:
+            commands = stack.enter_context(open(args.commands, "r"))
+        start = time.perf_counter()
+        turns = asyncio.run(play(game, commands))
+        elapsed = time.perf_counter() - start
+
+    rate = turns / elapsed if elapsed > 0 else 0.0
+    print(f"{turns} turns in {elapsed:.3f} s: {rate:.0f} turns/s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,8 +7,8 @@ gi.require_version("Gtk", "4.0")
 gi.require_version("Gdk", "4.0")
 
 from gi.repository import GLib, Gtk, Gdk, Gio
-from game import Game
-from extraction import ExtractedFile
+from game import Game, GAME_OVER_TEXT
+from cache import load_game
 from wordytextview import WordyTextView
 from contextlib import contextmanager
 from gui.filedialog import make_filter
@@ -16,20 +16,30 @@ from gui.mainloop import run
 
 from sys import argv
 from random import seed
+import tempfile
+
+# The most outputs the transcript shows before it trims the oldest.
+SCROLLBACK_PARAGRAPHS = 500
 
 
 @contextmanager
 def error_alert(window, text):
+    """Shows an error dialog over 'window'; the body of the with statement
+    can add to the dialog before it appears. It closes when dismissed."""
     dlg = Gtk.MessageDialog(
         transient_for=window,
+        modal=True,
         message_type=Gtk.MessageType.ERROR,
         buttons=Gtk.ButtonsType.CANCEL,
         text=text,
     )
     try:
         yield dlg
-    finally:
+    except BaseException:
         dlg.destroy()
+        raise
+    dlg.connect("response", lambda dlg, response: dlg.destroy())
+    dlg.present()
 
 
 async def get_game_path():
@@ -93,8 +103,7 @@ class GameWindow(Gtk.Window):
     def __init__(self, game_file):
         Gtk.Window.__init__(self)
 
-        with open(game_file, "r") as f:
-            self.game = GuiGame(ExtractedFile(f), self)
+        self.game = load_game(game_file, lambda extracted: GuiGame(extracted, self))
 
         title_label = Gtk.Label(label="Scott Dumb")
         title_label.add_css_class("title")
@@ -115,11 +124,20 @@ class GameWindow(Gtk.Window):
         self.room_view = WordyTextView(self.game, self.queue_command)
         #   self.room_view.connect("size-allocate", self.on_room_view_size_allocate)
 
-        self.script_view = WordyTextView(self.game, self.queue_command)
+        # The transcript keeps only the latest output; the rest goes to a
+        # temporary file, and comes back if you scroll up to it.
+        self.script_view = WordyTextView(
+            self.game,
+            self.queue_command,
+            scrollback=SCROLLBACK_PARAGRAPHS,
+            archive=tempfile.TemporaryFile("w+", encoding="utf-8"),
+        )
 
         self.inventory_view = WordyTextView(
             self.game, self.queue_command, width_request=300
         )
+        # The state's inventory_version when the inventory view was filled in.
+        self.shown_inventory_version = None
 
         vBox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, vexpand=True)
         vBox.append(self.room_view)
@@ -137,14 +155,14 @@ class GameWindow(Gtk.Window):
         self.command_entry = Gtk.Entry(hexpand=True)
         self.command_entry.connect("activate", self.on_command_activate)
 
-        score_button = Gtk.Button(
+        self.score_button = Gtk.Button(
             label="_Score", use_underline=True, halign=Gtk.Align.END
         )
-        score_button.connect("clicked", self.on_score)
-        score_button.set_margin_end(5)
+        self.score_button.connect("clicked", self.on_score)
+        self.score_button.set_margin_end(5)
         self.command_box.append(command_label)
         self.command_box.append(self.command_entry)
-        self.command_box.append(score_button)
+        self.command_box.append(self.score_button)
 
         self.scroller = Gtk.ScrolledWindow(hexpand=True)
         self.scroller.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
@@ -211,24 +229,31 @@ class GameWindow(Gtk.Window):
 
     def update_room_view(self):
         """
-        Generate the room description text afresh and displays it. The previous
-        room description is removed.
+        Generate the room description text afresh and displays it. Only the
+        parts that differ from the previous room description are replaced.
         """
         game = self.game
         if game.wants_room_update or game.needs_room_update:
-            words = game.player_room.get_look_words()
-            self.room_view.clear()
-            self.room_view.append_words(words)
+            words = game.get_look_words()
+            self.room_view.replace_words(words)
             game.needs_room_update = False
             game.wants_room_update = False
 
-        self.command_box.set_sensitive(not game.game_over)
+        # The command entry stays usable after the game ends, for UNDO.
+        self.score_button.set_sensitive(not game.game_over)
         self.update_inventory_view()
 
     def update_inventory_view(self):
-        words = self.game.get_inventory_words()
-        self.inventory_view.clear()
-        self.inventory_view.append_words(words)
+        """Displays the inventory, if it has changed since it was last shown;
+        if not, this just brings its underlines up to date."""
+        version = self.game.state.inventory_version
+        if version == self.shown_inventory_version:
+            self.inventory_view.refresh_underlines()
+        else:
+            words = self.game.get_inventory_words()
+            self.inventory_view.clear()
+            self.inventory_view.append_words(words)
+            self.shown_inventory_version = version
 
     async def before_turn(self):
         """
@@ -239,7 +264,9 @@ class GameWindow(Gtk.Window):
 
         if not game.game_over:
             await game.perform_occurances()
-            self.command_entry.grab_focus()
+        if game.game_over:
+            game.output_line(GAME_OVER_TEXT)
+        self.command_entry.grab_focus()
 
         self.flush_output()
         self.update_room_view()
@@ -256,7 +283,14 @@ class GameWindow(Gtk.Window):
 
     async def do_on_load_game(self, data):
         game = self.game
-        if await game.load_game():
+        try:
+            loaded = await game.load_game()
+        except (OSError, ValueError) as e:
+            with error_alert(self, "The game could not be loaded.") as dlg:
+                dlg.format_secondary_text(str(e))
+            return
+
+        if loaded:
             self.pending_command = None
             self.running_task = None
             game.extract_output()
@@ -301,6 +335,16 @@ class GameWindow(Gtk.Window):
         """This handles a user command; it parses it and
         echos it to the output, then starts it executing."""
         game = self.game
+        if game.parse_undo_command(cmd) is not None:
+            self.command_entry.set_text("")
+            game.output_line("> " + cmd)
+            game.perform_undo_command(cmd)
+            if game.game_over:
+                game.output_line(GAME_OVER_TEXT)
+            self.flush_output()
+            self.update_room_view()
+            return
+
         try:
             self.command_entry.set_text("")
             verb, noun = game.parse_command(cmd)
@@ -314,9 +358,10 @@ class GameWindow(Gtk.Window):
         await self.before_turn()
 
     def on_command_activate(self, data):
-        """Handles a user-entered command when the user hits enter."""
-        if not self.game.game_over:
-            cmd = self.command_entry.get_text()
+        """Handles a user-entered command when the user hits enter. Once the
+        game is over, only UNDO and REDO are accepted."""
+        cmd = self.command_entry.get_text()
+        if not self.game.game_over or self.game.parse_undo_command(cmd) is not None:
             self.queue_command(cmd)
 
     def on_score(self, data):
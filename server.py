@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+"""Serves a game to many players at once over TCP.
+
+Each connection plays its own game. The protocol is plain lines of text,
+so telnet or netcat will do as a client: the player sends a command per
+line, and the server replies with the game's output, followed by a prompt.
+The .DAT file is parsed only once, and its GameDefinition is shared by
+every session, however many players connect.
+"""
+
+import argparse
+import asyncio
+import sys
+from random import seed
+
+from extraction import load_extracted
+from compilation import compile_logics
+from game import Game, GameDefinition, WordError, words_to_text, GAME_OVER_TEXT
+
+# The longest command line we accept; longer ones end the session.
+MAX_LINE_LENGTH = 1024
+
+
+class SessionGame(Game):
+    """This game subclass writes its output to a network connection. Players
+    can't save or load games, as the server's files are not theirs."""
+
+    # Every session keeps its undo history, so keep it short.
+    undo_limit = 10
+
+    def __init__(self, definition, writer):
+        Game.__init__(self, definition)
+        self.writer = writer
+
+    def write_text(self, text):
+        """Writes text to the connection, with telnet line endings. This does not
+        wait for the text to be sent; GameServer does that after each turn."""
+        if text != "":
+            self.writer.write((text.replace("\n", "\r\n") + "\r\n").encode("utf-8"))
+
+    def flush_output(self):
+        self.write_text(words_to_text(self.extract_output()))
+
+        if self.needs_room_update:
+            self.write_text(words_to_text(self.get_look_words()))
+        self.needs_room_update = False
+        self.wants_room_update = False
+
+    async def get_save_game_path(self):
+        self.output_line("You can't save games here.")
+
+    async def get_load_game_path(self):
+        self.output_line("You can't load games here.")
+
+
+class GameServer:
+    """This plays a game with each client that connects.
+
+    definition - the GameDefinition every session plays
+    idle_timeout - seconds a client may wait between commands, or take to
+                   accept the output of one, before it is disconnected, or
+                   None to wait forever
+    max_sessions - the most clients that may play at once, or None for no limit
+    prompt - text written when the game is ready for a command
+    sessions - the number of clients playing now
+    """
+
+    def __init__(self, definition, idle_timeout=None, max_sessions=None, prompt="> "):
+        self.definition = definition
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.prompt = prompt
+        self.sessions = 0
+
+    async def serve(self, host, port):
+        """Accepts clients until cancelled."""
+        # A big backlog, so a crowd of players connecting at once is not
+        # turned away before we can accept them.
+        server = await asyncio.start_server(
+            self.handle_client, host, port, limit=MAX_LINE_LENGTH, backlog=4096
+        )
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        """Plays a game with one client, until it disconnects or the game ends
+        for good."""
+        try:
+            if self.max_sessions is not None and self.sessions >= self.max_sessions:
+                writer.write(b"Too many players; try again later.\r\n")
+                await self.drain(writer)
+                return
+
+            self.sessions += 1
+            try:
+                await self.play(SessionGame(self.definition, writer), reader, writer)
+            finally:
+                self.sessions -= 1
+        except (ConnectionError, TimeoutError, asyncio.LimitOverrunError, ValueError):
+            pass  # the client went away, went quiet, or sent garbage
+        finally:
+            writer.close()
+            try:
+                await asyncio.wait_for(writer.wait_closed(), self.idle_timeout)
+            except (ConnectionError, TimeoutError):
+                writer.transport.abort()  # it won't take the rest of its output
+
+    async def drain(self, writer):
+        """Waits until the client has taken enough of its output; this raises
+        TimeoutError if it takes longer than the idle timeout."""
+        await asyncio.wait_for(writer.drain(), self.idle_timeout)
+
+    async def play(self, game, reader, writer):
+        """Runs the turns of a game, reading commands from 'reader'. Once the game
+        is over, the client may still UNDO or REDO; any other command ends the
+        session."""
+
+        async def prompt():
+            if game.game_over:
+                game.write_text(GAME_OVER_TEXT)
+            writer.write(self.prompt.encode("utf-8"))
+            # This is where a slow client holds up its own session, and
+            # only its own.
+            await self.drain(writer)
+
+        async def before_turn():
+            if not game.game_over:
+                try:
+                    await game.perform_occurances()
+                except (ValueError, WordError) as e:
+                    game.output(str(e))
+            game.flush_output()
+            await prompt()
+
+        await before_turn()
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+            if line == b"":
+                break
+            cmd = line.decode("utf-8", errors="replace").strip()
+            if cmd == "":
+                writer.write(self.prompt.encode("utf-8"))
+                continue
+
+            if game.perform_undo_command(cmd):
+                game.flush_output()
+                await prompt()
+                continue
+
+            if game.game_over:
+                break
+
+            try:
+                verb, noun = game.parse_command(cmd)
+                await game.perform_command(verb, noun)
+            except (ValueError, WordError) as e:
+                game.output(str(e))
+            # The command's output goes on its own line, before that of the
+            # occurances.
+            game.flush_output()
+            await before_turn()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("game_file")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument(
+        "--idle-timeout", type=float, help="seconds before an idle client is dropped"
+    )
+    parser.add_argument("--max-sessions", type=int, help="the most clients at once")
+    parser.add_argument("--compile", action="store_true", help="compile game logic")
+    args = parser.parse_args()
+
+    seed()
+    definition = GameDefinition(load_extracted(args.game_file))
+    if args.compile:
+        compile_logics(definition)
+    server = GameServer(
+        definition,
+        idle_timeout=args.idle_timeout,
+        max_sessions=args.max_sessions,
+    )
+    print(f"Serving {args.game_file} on {args.host}:{args.port}", file=sys.stderr)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
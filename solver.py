@@ -0,0 +1,390 @@
+#!/usr/bin/python3
+"""Searches a game for the shortest way to win it.
+
+The solver plays every command it can from the starting state, then every
+command from each state that reaches, and so on, breadth first, until it
+stores all the treasures. Each state is visited once, however many ways
+lead to it. The commands are every verb with every noun (and with none),
+skipping those no logic handles, except one that stands for letting a
+turn pass.
+
+The states of each turn are shared among a pool of worker processes. The
+random numbers each command sees are seeded from the state and the
+command, so a search gives the same answer however many workers run it.
+That seeding lets the search count on lucky rolls of the dice, which a
+replay won't get, so each solution found is replayed from the start as
+headless.py plays it, with --seed 1, 2 and so on up to --seeds. It is
+accepted only if it wins under every one of them; otherwise the search
+goes on.
+Once more than --memory-limit states have been visited, they move to a
+database in a temporary file, so big games don't exhaust memory.
+
+The winning commands are written to stdout one per line, in the form
+headless.py reads.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import load_game
+from compilation import compile_logics
+from game import Game, WordError
+
+# What becomes of a state after a command.
+PLAYING = 0
+WON = 1
+LOST = 2
+
+
+class SolverGame(Game):
+    """This game subclass plays as fast as it can, and quietly. It can't
+    save or load, and keeps no undo history."""
+
+    undo_limit = 0
+    wait_seconds = 0.0
+
+    def output(self, text):
+        pass
+
+    def output_word(self, word):
+        pass
+
+    def output_message(self, number):
+        pass
+
+    async def get_save_game_path(self):
+        return None
+
+    async def get_load_game_path(self):
+        return None
+
+
+def get_state_key(snapshot):
+    """Returns the short hash that identifies a state snapshot."""
+    return hashlib.blake2b(snapshot, digest_size=16).digest()
+
+
+def get_commands(game):
+    """Returns the text of each command the solver tries; see the module
+    docstring for which these are."""
+    definition = game.definition
+    verbs = list(dict.fromkeys(definition.verbs.values()))
+    nouns = [None] + list(dict.fromkeys(definition.nouns.values()))
+    builtins = (definition.go_word, definition.get_word, definition.drop_word)
+
+    commands = []
+    idle = None
+    for verb in verbs:
+        for noun in nouns:
+            text = str(verb) if noun is None else f"{verb} {noun}"
+            if verb in builtins or len(definition.get_command_candidates(verb, noun)) > 0:
+                commands.append(text)
+            elif idle is None:
+                idle = text
+    if idle is not None:
+        commands.append(idle)
+    return commands
+
+
+def check_result(game):
+    """Returns WON if all the treasures are stored, LOST if the game has
+    ended otherwise, and PLAYING if it has not ended."""
+    if game.get_score()[1] == 100:
+        return WON
+    return LOST if game.game_over else PLAYING
+
+
+async def play_occurances(game):
+    """Runs the occurances that precede a command. Returns the result, as
+    check_result()."""
+    try:
+        await game.perform_occurances()
+    except (ValueError, WordError):
+        pass  # the game would print this, and carry on
+    return check_result(game)
+
+
+async def play_turn(game, command):
+    """Carries out a command, then the occurances that follow it, just as the
+    other front ends do. Returns the result, as check_result()."""
+    try:
+        verb, noun = game.parse_command(command)
+        await game.perform_command(verb, noun)
+    except (ValueError, WordError):
+        pass
+
+    result = check_result(game)
+    if result == PLAYING:
+        result = await play_occurances(game)
+    return result
+
+
+async def replay(game, start_snapshot, commands, seed):
+    """Plays the commands from the state in 'start_snapshot', the state of a
+    newly loaded game, as headless.py does with --seed 'seed'. Returns the
+    result after the last, as check_result()."""
+    game.state.restore(start_snapshot)
+    game.game_over = False
+    random.seed(seed)
+    result = await play_occurances(game)
+    for command in commands:
+        if result != PLAYING:
+            break
+        result = await play_turn(game, command)
+    return result
+
+
+def find_losing_seed(game, start_snapshot, commands, seeds):
+    """Replays the commands with --seed 1 up to 'seeds'; returns the first seed
+    they don't win with, or None if they win with all."""
+    for seed in range(1, seeds + 1):
+        if worker_loop.run_until_complete(replay(game, start_snapshot, commands, seed)) != WON:
+            return seed
+    return None
+
+
+# Each worker process has its own game, set up by start_worker().
+worker_game = None
+worker_commands = None
+worker_loop = None
+
+
+def start_worker(game_file, compile):
+    global worker_game, worker_commands, worker_loop
+    worker_game = load_game(game_file, SolverGame)
+    if compile:
+        compile_logics(worker_game.definition)
+    worker_commands = get_commands(worker_game)
+    worker_loop = asyncio.new_event_loop()
+
+
+def expand_states(states):
+    """Plays every command from each (key, snapshot) given. Returns a list of
+    (parent key, command index, key, snapshot, result) for each state reached;
+    commands that lead back to the state they started in, or to a state
+    already reached in this batch, are left out."""
+    return worker_loop.run_until_complete(expand_states_async(states))
+
+
+async def expand_states_async(states):
+    game = worker_game
+    state = game.state
+    reached = []
+    seen = set()
+
+    for parent_key, parent_snapshot in states:
+        seen.add(parent_key)
+        for index, command in enumerate(worker_commands):
+            state.restore(parent_snapshot)
+            game.game_over = False
+            random.seed(parent_key + index.to_bytes(4, "little"))
+            result = await play_turn(game, command)
+
+            snapshot = state.snapshot()
+            key = get_state_key(snapshot)
+            if key not in seen:
+                seen.add(key)
+                reached.append((parent_key, index, key, snapshot, result))
+    return reached
+
+
+class VisitedStates:
+    """This records each state the solver has reached, with the state and
+    command it was reached by. The most recent states are kept in a dict; the
+    rest spill into an sqlite database in a temporary file.
+
+    memory_limit - the most states to keep in memory, or None for no limit
+    spilled - the number of states in the database
+    """
+
+    def __init__(self, memory_limit=None):
+        self.memory_limit = memory_limit
+        self.recent = {}
+        self.spilled = 0
+        self.temp_dir = None
+        self.db = None
+
+    def __len__(self):
+        return len(self.recent) + self.spilled
+
+    def __contains__(self, key):
+        if key in self.recent:
+            return True
+        if self.db is None:
+            return False
+        row = self.db.execute("SELECT 1 FROM visited WHERE key = ?", (key,)).fetchone()
+        return row is not None
+
+    def add(self, key, parent_key, command):
+        """Records a state, if it is new. Returns False if it was visited already."""
+        if key in self:
+            return False
+
+        self.recent[key] = (parent_key, command)
+        if self.memory_limit is not None and len(self.recent) > self.memory_limit:
+            self.spill()
+        return True
+
+    def get(self, key):
+        """Returns the (parent key, command) a state was reached by."""
+        found = self.recent.get(key)
+        if found is None:
+            found = self.db.execute(
+                "SELECT parent, command FROM visited WHERE key = ?", (key,)
+            ).fetchone()
+        return found
+
+    def spill(self):
+        """Moves the states in memory into the database."""
+        if self.db is None:
+            self.temp_dir = tempfile.TemporaryDirectory()
+            self.db = sqlite3.connect(os.path.join(self.temp_dir.name, "visited.db"))
+            self.db.execute("PRAGMA journal_mode = OFF")
+            self.db.execute("PRAGMA synchronous = OFF")
+            self.db.execute(
+                "CREATE TABLE visited (key BLOB PRIMARY KEY, parent BLOB, command INTEGER)"
+                " WITHOUT ROWID"
+            )
+
+        self.db.executemany(
+            "INSERT INTO visited VALUES (?, ?, ?)",
+            ((key, parent, command) for key, (parent, command) in self.recent.items()),
+        )
+        self.db.commit()
+        self.spilled += len(self.recent)
+        self.recent.clear()
+
+    def get_path(self, key):
+        """Returns the command indices that lead from the start to a state."""
+        path = []
+        while True:
+            parent_key, command = self.get(key)
+            if parent_key is None:
+                break
+            path.append(command)
+            key = parent_key
+        path.reverse()
+        return path
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.temp_dir.cleanup()
+
+
+def split_list(items, count):
+    """Splits a list into about 'count' lists of similar length."""
+    size = max(1, -(-len(items) // count))
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def solve(game_file, workers=None, max_turns=None, memory_limit=None, compile=False, seeds=10):
+    """Searches for the shortest list of commands that wins the game, when
+    replayed with each of --seed 1 up to 'seeds'. Returns it, or None if there
+    is no way to win within 'max_turns'. Progress goes to stderr."""
+    workers = workers or os.cpu_count()
+
+    # The start is the state after the occurances that precede the first
+    # command.
+    start_worker(game_file, compile)
+    game = worker_game
+    commands = worker_commands
+    if game.treasure_count == 0:
+        raise ValueError("This game has no treasures to store.")
+
+    start_snapshot = game.state.snapshot()
+    random.seed(b"start")
+    worker_loop.run_until_complete(game.perform_occurances())
+    snapshot = game.state.snapshot()
+    key = get_state_key(snapshot)
+    visited = VisitedStates(memory_limit)
+    visited.add(key, None, None)
+    if check_result(game) == WON and find_losing_seed(game, start_snapshot, [], seeds) is None:
+        return []
+
+    print(f"{len(commands)} commands, {workers} workers", file=sys.stderr)
+    start = time.perf_counter()
+    frontier = [(key, snapshot)]
+    turn = 0
+
+    try:
+        with ProcessPoolExecutor(workers, initializer=start_worker, initargs=(game_file, compile)) as pool:
+            while len(frontier) > 0 and (max_turns is None or turn < max_turns):
+                turn += 1
+                next_frontier = []
+                # More batches than workers, so that a slow batch does not leave
+                # the others idle.
+                batches = split_list(frontier, workers * 4)
+                for reached in pool.map(expand_states, batches):
+                    for parent_key, command, key, snapshot, result in reached:
+                        if not visited.add(key, parent_key, command):
+                            continue
+                        if result == WON:
+                            solution = [commands[c] for c in visited.get_path(key)]
+                            seed = find_losing_seed(game, start_snapshot, solution, seeds)
+                            if seed is None:
+                                return solution
+                            print(
+                                f"turn {turn}: a solution needs luck; it loses with --seed {seed}",
+                                file=sys.stderr,
+                            )
+                        if result == PLAYING:
+                            next_frontier.append((key, snapshot))
+                frontier = next_frontier
+
+                elapsed = time.perf_counter() - start
+                print(
+                    f"turn {turn}: {len(frontier)} new states, {len(visited)} visited"
+                    f" ({visited.spilled} on disk), {elapsed:.1f} s",
+                    file=sys.stderr,
+                )
+    finally:
+        visited.close()
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("game_file")
+    parser.add_argument("--workers", type=int, help="processes to use; default one per core")
+    parser.add_argument("--max-turns", type=int, help="give up after this many commands")
+    parser.add_argument(
+        "--memory-limit", type=int, help="states to keep in memory before using disk"
+    )
+    parser.add_argument("--compile", action="store_true", help="compile game logic")
+    parser.add_argument(
+        "--seeds",
+        type=int,
+        default=10,
+        help="a solution must win with --seed 1 up to this; default 10",
+    )
+    args = parser.parse_args()
+
+    solution = solve(
+        args.game_file,
+        workers=args.workers,
+        max_turns=args.max_turns,
+        memory_limit=args.memory_limit,
+        compile=args.compile,
+        seeds=args.seeds,
+    )
+    if solution is None:
+        print("No solution found.", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"This wins with headless.py --seed 1 up to --seed {args.seeds}.", file=sys.stderr)
+
+    for command in solution:
+        print(command)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import itertools
+import struct
+from array import array
+
+# The number of flags and counters each game has.
+FLAG_COUNT = 32
+COUNTER_COUNT = 16
+
+# Flags with special meanings.
+DARK_FLAG = 15
+LAMP_EXHAUSTED_FLAG = 16
+
+# Locations are room numbers, or one of these. Room 0 is a real room
+# that items can be put in, so 'nowhere' needs its own number.
+INVENTORY = -1
+NOWHERE = -2
+
+# Marks the end of a list of items in GameState.heads and next_items.
+_END = -1
+
+# Item versions are drawn from this, so no two states ever share one.
+_versions = itertools.count()
+
+# player_loc, saved_player_loc, flags, counter, light_remaining
+_fixed = struct.Struct("<hhIqq")
+
+
+class GameState:
+    """This holds the parts of a game that change as it is played. Each Game
+    session has its own, while sharing the GameDefinition.
+
+    The state is kept in compact form: locations are room numbers (or
+    INVENTORY or NOWHERE), flags are bits of one int, and the lists are
+    arrays, so that snapshot() can capture it all as one bytes object.
+
+    player_loc - the location of the player
+    saved_player_loc - a location the player was in
+    saved_player_locs - an array of more locations the player was in
+    flags - the 32 flags, as bits of an int; flag n is (flags >> n) & 1
+    counter - the current counter value
+    counters - an array of 16 more counter values
+    light_remaining - number of turns of lamp use left
+    item_locs - the location of each item, by item index. Use place_item
+                to change this.
+    heads, next_items - the items at each location, as linked lists in item
+                        order. heads holds the first item index for each room
+                        number, with INVENTORY's at the end (as it is -1), and
+                        next_items the index of the item after each item.
+                        place_item keeps these up to date.
+    changed_items - a bitmask of the items moved since the Game last looked,
+                    by item index; the bit after the last item's is set when
+                    the inventory changes (this is inventory_bit), and all
+                    bits by restore().
+    item_version - a number that changes whenever an item moves, or the state
+                   is restored; it is never reused, even by other states.
+    inventory_version - like item_version, but changes only when an item
+                        enters or leaves the inventory, or the state is
+                        restored.
+    """
+
+    def __init__(self, definition):
+        self.items = definition.items
+        self.player_loc = definition.starting_room.index
+        self.saved_player_loc = self.player_loc
+        self.saved_player_locs = array("h", [self.player_loc] * COUNTER_COUNT)
+        self.flags = 0
+        self.counter = 0
+        self.counters = array("q", [0] * COUNTER_COUNT)
+        self.light_remaining = definition.light_duration
+
+        self.item_locs = array("h", [NOWHERE] * len(definition.items))
+        self.heads = array("h", [_END] * (len(definition.rooms) + 1))
+        self.next_items = array("h", [_END] * len(definition.items))
+        self.inventory_bit = 1 << len(definition.items)
+        self.changed_items = 0
+        self.item_version = 0
+        self.inventory_version = next(_versions)
+        for item in definition.items:
+            self.place_item(item, item.starting_loc)
+
+    def get_flag(self, n):
+        """Returns the state of flag n, as a boolean."""
+        return (self.flags >> n) & 1 != 0
+
+    def set_flag(self, n, value):
+        """Sets or clears flag n."""
+        if value:
+            self.flags |= 1 << n
+        else:
+            self.flags &= ~(1 << n)
+
+    def get_items(self, loc):
+        """Returns a list of items that are at a location."""
+        items = []
+        index = self.heads[loc]
+        while index != _END:
+            items.append(self.items[index])
+            index = self.next_items[index]
+        return items
+
+    def get_item_count(self, loc):
+        """Returns the number of items at a location."""
+        count = 0
+        index = self.heads[loc]
+        while index != _END:
+            count += 1
+            index = self.next_items[index]
+        return count
+
+    def place_item(self, item, loc):
+        """Sets the location of an item, and updates the lists of items at each
+        location to match."""
+        heads = self.heads
+        next_items = self.next_items
+        index = item.index
+
+        old_loc = self.item_locs[index]
+        self.item_version = next(_versions)
+        self.changed_items |= 1 << index
+        if old_loc == INVENTORY or loc == INVENTORY:
+            self.changed_items |= self.inventory_bit
+            self.inventory_version = self.item_version
+
+        if old_loc != NOWHERE:
+            previous = _END
+            current = heads[old_loc]
+            while current != index:
+                previous = current
+                current = next_items[current]
+            if previous == _END:
+                heads[old_loc] = next_items[index]
+            else:
+                next_items[previous] = next_items[index]
+
+        self.item_locs[index] = loc
+        if loc != NOWHERE:
+            previous = _END
+            current = heads[loc]
+            while current != _END and current < index:
+                previous = current
+                current = next_items[current]
+            next_items[index] = current
+            if previous == _END:
+                heads[loc] = index
+            else:
+                next_items[previous] = index
+
+    def get_version(self):
+        """Returns a value that is different whenever anything a condition can
+        read differs: item locations, flags, the counter or the player's
+        location. The item_version stands for the items; the others are small
+        numbers, and make up the rest."""
+        return (self.item_version, self.flags, self.counter, self.player_loc)
+
+    def snapshot(self):
+        """Returns the whole state as bytes; restore() takes it back."""
+        fixed = _fixed.pack(
+            self.player_loc,
+            self.saved_player_loc,
+            self.flags,
+            self.counter,
+            self.light_remaining,
+        )
+        return b"".join(
+            (
+                fixed,
+                self.saved_player_locs.tobytes(),
+                self.counters.tobytes(),
+                self.item_locs.tobytes(),
+                self.heads.tobytes(),
+                self.next_items.tobytes(),
+            )
+        )
+
+    def restore(self, data):
+        """Puts the state back as it was when snapshot() returned 'data'."""
+        (
+            self.player_loc,
+            self.saved_player_loc,
+            self.flags,
+            self.counter,
+            self.light_remaining,
+        ) = _fixed.unpack_from(data)
+
+        start = _fixed.size
+        for values in (
+            self.saved_player_locs,
+            self.counters,
+            self.item_locs,
+            self.heads,
+            self.next_items,
+        ):
+            end = start + len(values) * values.itemsize
+            values[:] = array(values.typecode, data[start:end])
+            start = end
+        self.changed_items = -1
+        self.item_version = next(_versions)
+        self.inventory_version = self.item_version
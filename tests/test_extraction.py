@@ -0,0 +1,176 @@
+"""Tests for reading .DAT files, particularly malformed ones. Run from the
+repository root:
+
+    python -m unittest discover tests
+"""
+
+import io
+import unittest
+
+from extraction import DatError, DatReader, ExtractedFile
+
+# A tiny game: one item, one action, two verbs and nouns, two rooms and
+# one message. The numbers have spaces around them, as real files do.
+GOOD_LINES = [
+    # header: unknown, items, actions, words, rooms, carried, start,
+    # treasures, word length, light, messages, treasure room
+    " 0 ", " 0 ", " 0 ", " 1 ", " 1 ", " 5 ", " 1 ", " 0 ", " 3 ", " 100 ", " 0 ", " 0 ",
+    # the action
+    " 1059 ", " 0 ", " 0 ", " 0 ", " 0 ", " 0 ", " 8400 ", " 0 ",
+    # verbs and nouns
+    '"AUT"', '"ANY"', '"GO"', '"NOR"',
+    # rooms
+    " 0 ", " 0 ", " 0 ", " 0 ", " 0 ", " 0 ", '""',
+    " 0 ", " 0 ", " 0 ", " 0 ", " 0 ", " 0 ", '"big room"',
+    # messages
+    '""',
+    # items
+    '"lamp/LAM/" 1 ',
+    # comments
+    '"look around"',
+    " 416 ", " 1 ", " 0 ",
+]
+
+
+def make_dat(lines):
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def read_dat(data, strict):
+    return ExtractedFile(DatReader(data, strict))
+
+
+def summarize(extracted):
+    """Returns the parts of an ExtractedFile the tests compare."""
+    return (
+        extracted.starting_room,
+        [a.nums for a in extracted.actions],
+        extracted.verbs,
+        extracted.nouns,
+        [(r.north, r.down, r.description) for r in extracted.rooms],
+        list(extracted.messages),
+        [(i.description, i.starting_room, i.carry_word) for i in extracted.items],
+        [a.comment for a in extracted.actions],
+    )
+
+
+class WellFormedTest(unittest.TestCase):
+    def test_readers_agree(self):
+        data = make_dat(GOOD_LINES)
+        expected = summarize(ExtractedFile(io.StringIO(data.decode("utf-8"))))
+        self.assertEqual(summarize(read_dat(data, False)), expected)
+        self.assertEqual(summarize(read_dat(data, True)), expected)
+
+    def test_values(self):
+        extracted = read_dat(make_dat(GOOD_LINES), True)
+        self.assertEqual(extracted.actions[0].nums, [1059, 0, 0, 0, 0, 0, 8400, 0])
+        self.assertEqual(extracted.rooms[1].description, "big room")
+        self.assertEqual(extracted.items[0].description, "lamp")
+        self.assertEqual(extracted.items[0].carry_word, "LAM")
+        self.assertEqual(extracted.items[0].starting_room, 1)
+
+    def test_crlf(self):
+        data = make_dat(GOOD_LINES)
+        expected = summarize(read_dat(data, True))
+        self.assertEqual(summarize(read_dat(data.replace(b"\n", b"\r\n"), True)), expected)
+
+
+class MalformedGapTest(unittest.TestCase):
+    def replace_line(self, old, new):
+        lines = list(GOOD_LINES)
+        lines[lines.index(old)] = new
+        return lines
+
+    def assertDatError(self, data, offset):
+        with self.assertRaises(DatError) as cm:
+            read_dat(data, True)
+        self.assertEqual(cm.exception.offset, offset)
+
+    def test_two_numbers_on_a_line(self):
+        # Without strict, only the first number on a line counts, however
+        # the rest of the gap is laid out.
+        expected = summarize(read_dat(make_dat(GOOD_LINES), False))
+        lines = self.replace_line(" 1059 ", " 1059  7")
+        self.assertEqual(summarize(read_dat(make_dat(lines), False)), expected)
+
+        lines.insert(lines.index(" 8400 "), "")
+        data = make_dat(lines)
+        self.assertEqual(summarize(read_dat(data, False)), expected)
+        self.assertDatError(data, data.index(b" 1059  7") + 5)
+
+    def test_blank_line(self):
+        expected = summarize(read_dat(make_dat(GOOD_LINES), False))
+        lines = list(GOOD_LINES)
+        lines.insert(lines.index(" 8400 "), "")
+        data = make_dat(lines)
+        self.assertEqual(summarize(read_dat(data, False)), expected)
+        self.assertDatError(data, data.index(b"\n\n") + 1)
+
+    def test_junk_after_number(self):
+        data = make_dat(self.replace_line(" 1059 ", " 1059x"))
+        self.assertEqual(read_dat(data, False).actions[0].nums[0], 1059)
+        self.assertDatError(data, data.index(b"1059x") + 4)
+
+    def test_not_a_number(self):
+        data = make_dat(self.replace_line(" 1059 ", " x"))
+        for strict in (False, True):
+            with self.assertRaises(DatError) as cm:
+                read_dat(data, strict)
+            self.assertEqual(cm.exception.offset, data.index(b" x\n") + 1)
+
+    def test_extra_number_before_string(self):
+        lines = list(GOOD_LINES)
+        lines.insert(lines.index('"big room"'), " 3 ")
+        lines.insert(lines.index('"big room"'), "")
+        data = make_dat(lines)
+        for strict in (False, True):
+            self.assertRaises(DatError, read_dat, data, strict)
+
+    def test_missing_number(self):
+        lines = list(GOOD_LINES)
+        del lines[lines.index('"big room"') - 1]
+        data = make_dat(lines)
+        for strict in (False, True):
+            with self.assertRaises(DatError) as cm:
+                read_dat(data, strict)
+            self.assertEqual(cm.exception.offset, data.index(b'"big room"'))
+
+    def test_string_does_not_start_its_line(self):
+        data = make_dat(self.replace_line('"big room"', ' "big room"'))
+        self.assertEqual(read_dat(data, False).rooms[1].description, "big room")
+        self.assertDatError(data, data.index(b'"big room"'))
+
+    def test_truncated(self):
+        data = make_dat(GOOD_LINES)
+        end = data.index(b'"look around"')
+        for strict in (False, True):
+            with self.assertRaises(DatError) as cm:
+                read_dat(data[:end], strict)
+            self.assertEqual(cm.exception.offset, end)
+
+
+class ItemRoomTest(unittest.TestCase):
+    def make_item_dat(self, line):
+        lines = list(GOOD_LINES)
+        lines[lines.index('"lamp/LAM/" 1 ')] = line
+        return make_dat(lines)
+
+    def test_junk_after_room(self):
+        data = self.make_item_dat('"lamp/LAM/" 1x')
+        self.assertEqual(read_dat(data, False).items[0].starting_room, 1)
+        with self.assertRaises(DatError) as cm:
+            read_dat(data, True)
+        self.assertEqual(cm.exception.offset, data.index(b" 1x") + 2)
+
+    def test_missing_room(self):
+        for line, value in (('"lamp/LAM/"', b"\n"), ('"lamp/LAM/" one', b"one")):
+            data = self.make_item_dat(line)
+            offset = data.index(value, data.index(b"lamp"))
+            for strict in (False, True):
+                with self.assertRaises(DatError) as cm:
+                    read_dat(data, strict)
+                self.assertEqual(cm.exception.offset, offset)
+
+
+if __name__ == "__main__":
+    unittest.main()
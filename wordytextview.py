@@ -1,13 +1,53 @@
+from collections import deque
+
 from gi.repository import Pango
 from gi.repository import Gdk
 from gi.repository import Gtk
 
 
 class WordyTextView(Gtk.TextView):
-    def __init__(self, game, perform_command, **kwargs):
+    """A text view of OutputWords, in which words that offer commands are
+    underlined, and can be clicked for a menu of them.
+
+    words_by_tag - the word each underlining tag was made for
+    tags_by_word - the tag made for each word; the same OutputWord may be
+                   shown by many views, so each keeps its own
+    underline_version - the game state version underlines should reflect;
+                        see refresh_underlines()
+    tag_versions - the state version each tag's underline was last set for
+    clickable_tags - the set of tags that are underlined, as their words
+                     have commands
+    shown_pieces - the (separator, word) pairs that make up the text, if
+                   replace_words() put it there; None otherwise
+
+    scrollback - the most paragraphs (calls to append_words) to keep; older
+                 ones are trimmed away, with their tags. None keeps them all.
+    archive - a text file opened for reading and writing, to which trimmed
+              paragraphs are written, or None to discard them. When the view
+              is scrolled to the top, they are paged back in, as plain text.
+    page_size - how many paragraphs to page in from the archive at once
+    paragraph_marks - a mark at the start of each paragraph in the view
+    archived_paragraphs - the (position, length) of each paragraph in the archive
+    first_paged_in - the index in archived_paragraphs of the first paragraph
+                     in the view; the ones from here on are paged in, and
+                     are at the top of the view.
+    """
+
+    def __init__(self, game, perform_command, scrollback=None, archive=None, **kwargs):
         self.game = game
         self.perform_command = perform_command
         self.words_by_tag = {}
+        self.tags_by_word = {}
+        self.underline_version = None
+        self.tag_versions = {}
+        self.clickable_tags = set()
+        self.shown_pieces = []
+        self.scrollback = scrollback
+        self.archive = archive
+        self.page_size = 50
+        self.paragraph_marks = deque()
+        self.archived_paragraphs = []
+        self.first_paged_in = 0
         self.buffer = Gtk.TextBuffer()
         Gtk.TextView.__init__(
             self, buffer=self.buffer, editable=False, cursor_visible=False, **kwargs
@@ -18,10 +58,22 @@ class WordyTextView(Gtk.TextView):
         click_gesture.connect("pressed", self.on_pressed)
         self.add_controller(click_gesture)
 
+        # The pointer changes over words with commands; we make each cursor
+        # only once.
+        self.text_cursor = Gdk.Cursor.new_from_name("text", None)
+        self.pointer_cursor = Gdk.Cursor.new_from_name("pointer", None)
+        self.current_cursor = None
+
         motion_controller = Gtk.EventControllerMotion()
         motion_controller.connect("motion", self.on_motion)
         self.add_controller(motion_controller)
 
+        # When scrolled, we catch up on the underlines of the words that come
+        # into view.
+        self.watched_adjustment = None
+        self.connect("notify::vadjustment", self.on_vadjustment_changed)
+        self.on_vadjustment_changed(self, None)
+
     def append_line(self):
         """Adds a line break to the view. If it is now empty, this does nothing."""
         iter = self.buffer.get_end_iter()
@@ -34,21 +86,67 @@ class WordyTextView(Gtk.TextView):
         active commands on any words, this will record takes for them and
         underline them so they can be handled.
         """
+        pieces = self.lay_out_words(words)
 
-        def get_tag(word):
-            if word.is_plain(self.game):
-                return None
+        if self.scrollback is not None:
+            mark = self.buffer.create_mark(None, self.buffer.get_end_iter(), True)
+            self.paragraph_marks.append(mark)
 
-            if self.buffer in word.tags:
-                return word.tags[self.buffer]
-            else:
-                tag = Gtk.TextTag()
-                tag.set_property("underline", Pango.Underline.SINGLE)
-                self.buffer.get_tag_table().add(tag)
-                self.words_by_tag[tag] = word
-                word.tags[self.buffer] = tag
-                return tag
+        self.insert_pieces(self.buffer.get_end_iter(), pieces)
+        self.shown_pieces = None
+
+        if self.scrollback is not None and len(self.paragraph_marks) > self.scrollback:
+            self.trim(len(self.paragraph_marks) - self.scrollback)
+
+    def replace_words(self, words):
+        """
+        Replaces the text of the view with a sequence of words, as clear() and
+        then append_words() would. But if replace_words() put the text there,
+        only the words that differ are replaced; the words before and after
+        them are left alone, and keep their tags.
+        """
+        new_pieces = self.lay_out_words(words)
+        old_pieces = self.shown_pieces
+        if old_pieces is None:
+            self.clear()
+            old_pieces = self.shown_pieces
+
+        limit = min(len(old_pieces), len(new_pieces))
+        prefix = 0
+        while prefix < limit and self.is_same_piece(old_pieces[prefix], new_pieces[prefix]):
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and self.is_same_piece(
+            old_pieces[-1 - suffix], new_pieces[-1 - suffix]
+        ):
+            suffix += 1
+
+        kept_before = old_pieces[:prefix]
+        kept_after = old_pieces[len(old_pieces) - suffix :]
+        removed = old_pieces[prefix : len(old_pieces) - suffix]
+        added = new_pieces[prefix : len(new_pieces) - suffix]
+
+        start_offset = sum(len(sep) + len(str(word)) for sep, word in kept_before)
+        end_offset = start_offset + sum(len(sep) + len(str(word)) for sep, word in removed)
+        start = self.buffer.get_iter_at_offset(start_offset)
+        end = self.buffer.get_iter_at_offset(end_offset)
+        removed_tags = self.get_tags_between(start, end)
+        self.buffer.delete(start, end)
+        self.insert_pieces(self.buffer.get_iter_at_offset(start_offset), added)
+        self.remove_unused_tags(removed_tags)
+        self.shown_pieces = kept_before + added + kept_after
 
+        # The words we kept may have gained or lost commands since.
+        version = self.game.state.get_version()
+        for sep, word in kept_before + kept_after:
+            tag = self.tags_by_word.get(word)
+            if tag is not None:
+                self.check_clickable(tag, version)
+
+    def lay_out_words(self, words):
+        """Returns the (separator, word) pairs that make up the text for a
+        sequence of words. Leading and trailing line breaks are dropped, and
+        each word after the first in a line is separated by a space."""
         words = list(words)
         while len(words) > 0 and words[0].is_newline:
             del words[0]
@@ -56,29 +154,221 @@ class WordyTextView(Gtk.TextView):
         while len(words) > 0 and words[-1].is_newline:
             del words[-1]
 
-        iter = self.buffer.get_end_iter()
+        pieces = []
         word_index = 0
         for word in words:
-            if word_index > 0:
-                self.buffer.insert(iter, " ")
-            tag = get_tag(word)
-            if tag is None:
-                self.buffer.insert(iter, str(word))
-            else:
-                self.buffer.insert_with_tags(iter, str(word), tag)
+            pieces.append((" " if word_index > 0 else "", word))
 
             if word.is_newline:
                 word_index = 0
             else:
                 word_index += 1
+        return pieces
 
-    def refresh_underlines(self):
-        """Hides underlines on words whose commands are no longer available."""
-        for tag, word in self.words_by_tag.items():
-            if word.is_plain(self.game):
-                tag.set_property("underline", Pango.Underline.NONE)
+    def is_same_piece(self, old, new):
+        """Decides if a piece from lay_out_words() that is shown can stay in
+        place of a new one: they must display the same way and refer to the
+        same things. A shown word with no tag can't stand for one that now
+        has commands, as it would not be clickable."""
+        (old_sep, old_word), (new_sep, new_word) = old, new
+        if old_sep != new_sep:
+            return False
+        if old_word is not new_word and (
+            old_word.text != new_word.text
+            or old_word.item is not new_word.item
+            or old_word.direction != new_word.direction
+            or old_word.vocab_noun != new_word.vocab_noun
+            or old_word.vocab_verb != new_word.vocab_verb
+        ):
+            return False
+        return old_word in self.tags_by_word or new_word.is_plain(self.game)
+
+    def insert_pieces(self, iter, pieces):
+        """Inserts pieces from lay_out_words() at 'iter', with tags for the
+        words that have commands."""
+        for sep, word in pieces:
+            if sep != "":
+                self.buffer.insert(iter, sep)
+            tag = self.get_tag(word)
+            if tag is None:
+                self.buffer.insert(iter, str(word))
             else:
-                tag.set_property("underline", Pango.Underline.SINGLE)
+                self.buffer.insert_with_tags(iter, str(word), tag)
+
+    def get_tag(self, word):
+        """Returns the tag for a word, creating it if need be, or None if the
+        word has no commands."""
+        if word.is_plain(self.game):
+            return None
+
+        tag = self.tags_by_word.get(word)
+        if tag is None:
+            tag = Gtk.TextTag()
+            self.buffer.get_tag_table().add(tag)
+            self.words_by_tag[tag] = word
+            self.tags_by_word[word] = tag
+
+        self.set_underline(tag, True)
+        self.tag_versions[tag] = self.game.state.get_version()
+        return tag
+
+    def get_paragraph_text(self, index):
+        """Returns the text of a paragraph in the view, by index."""
+        start = self.buffer.get_iter_at_mark(self.paragraph_marks[index])
+        if index + 1 < len(self.paragraph_marks):
+            end = self.buffer.get_iter_at_mark(self.paragraph_marks[index + 1])
+        else:
+            end = self.buffer.get_end_iter()
+        return self.buffer.get_text(start, end, False).strip("\n")
+
+    def trim(self, count):
+        """Removes the first 'count' paragraphs from the view, and the tags
+        that are used only by them. Paragraphs that were not paged in from
+        the archive are written to it, if there is one."""
+        paged_in = len(self.archived_paragraphs) - self.first_paged_in
+        if self.archive is not None:
+            for index in range(paged_in, count):
+                text = self.get_paragraph_text(index) + "\n"
+                self.archive.seek(0, 2)
+                self.archived_paragraphs.append((self.archive.tell(), len(text)))
+                self.archive.write(text)
+
+        if count >= paged_in:
+            self.first_paged_in = len(self.archived_paragraphs)
+        else:
+            self.first_paged_in += count
+
+        start = self.buffer.get_start_iter()
+        end = self.buffer.get_iter_at_mark(self.paragraph_marks[count])
+        trimmed_tags = self.get_tags_between(start, end)
+        self.buffer.delete(start, end)
+        for n in range(count):
+            self.buffer.delete_mark(self.paragraph_marks.popleft())
+        self.remove_unused_tags(trimmed_tags)
+
+    def get_tags_between(self, start, end):
+        """Returns the set of tags used in the text between two iters."""
+        tags = set()
+        iter = start.copy()
+        while iter.compare(end) < 0:
+            tags.update(iter.get_tags())
+            if not iter.forward_to_tag_toggle(None):
+                break
+        return tags
+
+    def remove_unused_tags(self, tags):
+        """Forgets those of the tags given that are no longer in the text."""
+        # A word's tag may also be used elsewhere in the view; those we keep.
+        tag_table = self.buffer.get_tag_table()
+        for tag in tags:
+            if self.buffer.get_start_iter().forward_to_tag_toggle(tag):
+                continue
+            word = self.words_by_tag.pop(tag, None)
+            if word is not None:
+                del self.tags_by_word[word]
+            self.tag_versions.pop(tag, None)
+            self.clickable_tags.discard(tag)
+            tag_table.remove(tag)
+
+    def page_in(self, count):
+        """Puts back the last 'count' archived paragraphs that are not in
+        the view, at its top. They come back as plain text, without underlines."""
+        count = min(count, self.first_paged_in)
+        if count == 0:
+            return
+
+        self.first_paged_in -= count
+        texts = []
+        for position, length in self.archived_paragraphs[
+            self.first_paged_in : self.first_paged_in + count
+        ]:
+            self.archive.seek(position)
+            texts.append(self.archive.read(length))
+
+        offsets = []
+        offset = 0
+        for text in texts:
+            self.buffer.insert(self.buffer.get_iter_at_offset(offset), text)
+            offsets.append(offset)
+            offset += len(text)
+
+        # The old first paragraph's mark has left gravity, so it stayed at
+        # the start as we inserted there; it belongs after the new text.
+        if len(self.paragraph_marks) > 0:
+            self.buffer.move_mark(
+                self.paragraph_marks[0], self.buffer.get_iter_at_offset(offset)
+            )
+        marks = [
+            self.buffer.create_mark(None, self.buffer.get_iter_at_offset(o), True)
+            for o in offsets
+        ]
+        self.paragraph_marks.extendleft(reversed(marks))
+
+    def refresh_underlines(self):
+        """Hides underlines on words whose commands are no longer available,
+        and shows them on words whose commands are. Only the words on screen
+        are checked now; the rest are checked as they scroll into view, so
+        this does not get slower as the view fills up."""
+        self.underline_version = self.game.state.get_version()
+        self.refresh_visible_underlines()
+
+    def refresh_visible_underlines(self):
+        """Brings the underlines of the words on screen up to date."""
+        version = self.underline_version
+        if version is None or len(self.words_by_tag) == 0:
+            return
+
+        rect = self.get_visible_rect()
+        iter, _ = self.get_line_at_y(rect.y)
+        end, _ = self.get_line_at_y(rect.y + rect.height)
+        end.forward_to_line_end()
+
+        # Each tagged word starts at a tag toggle, so we hop from one to the next.
+        while iter.compare(end) < 0:
+            for tag in iter.get_tags():
+                self.check_clickable(tag, version)
+            if not iter.forward_to_tag_toggle(None):
+                break
+
+    def check_clickable(self, tag, version):
+        """Returns True if a tag's word has commands. Its underline is brought
+        up to date for the state version given first, if it is not already;
+        this is the only time the word's commands are looked at."""
+        word = self.words_by_tag.get(tag)
+        if word is None:
+            return False
+        if self.tag_versions.get(tag) != version:
+            self.tag_versions[tag] = version
+            self.set_underline(tag, not word.is_plain(self.game))
+        return tag in self.clickable_tags
+
+    def set_underline(self, tag, underline):
+        """Shows or hides the underline a tag gives, if it needs to change."""
+        if underline and tag not in self.clickable_tags:
+            self.clickable_tags.add(tag)
+            tag.set_property("underline", Pango.Underline.SINGLE)
+        elif not underline and tag in self.clickable_tags:
+            self.clickable_tags.discard(tag)
+            tag.set_property("underline", Pango.Underline.NONE)
+
+    def on_vadjustment_changed(self, view, param):
+        adjustment = self.get_vadjustment()
+        if adjustment is not None and adjustment != self.watched_adjustment:
+            adjustment.connect("value-changed", self.on_scrolled)
+            adjustment.connect("changed", self.on_adjustment_changed)
+        self.watched_adjustment = adjustment
+
+    def on_scrolled(self, adjustment):
+        self.refresh_visible_underlines()
+
+        # Scrolling up to the top pages in more from the archive.
+        at_top = adjustment.get_value() <= adjustment.get_lower()
+        scrollable = adjustment.get_upper() - adjustment.get_lower() > adjustment.get_page_size()
+        if self.first_paged_in > 0 and at_top and scrollable:
+            self.page_in(self.page_size)
+
+    def on_adjustment_changed(self, adjustment):
+        self.refresh_visible_underlines()
 
     def clear(self):
         """Clears the text from this view."""
@@ -89,9 +379,21 @@ class WordyTextView(Gtk.TextView):
 
         tag_table = self.buffer.get_tag_table()
 
-        for tag in self.words_by_tag:
-            del self.words_by_tag[tag].tags[self.buffer]
         self.words_by_tag = {}
+        self.tags_by_word = {}
+        self.underline_version = None
+        self.tag_versions = {}
+        self.clickable_tags = set()
+        self.shown_pieces = []
+
+        for mark in self.paragraph_marks:
+            self.buffer.delete_mark(mark)
+        self.paragraph_marks.clear()
+        self.archived_paragraphs = []
+        self.first_paged_in = 0
+        if self.archive is not None:
+            self.archive.seek(0)
+            self.archive.truncate()
 
         tag_table.foreach(lambda tag: tag_table.remove(tag))
 
@@ -100,14 +402,20 @@ class WordyTextView(Gtk.TextView):
         found, i = self.get_iter_at_location(x, y)
         has_commands = False
         if found and not self.game.game_over:
+            # Views that are refreshed each turn have a version to check
+            # against; the others are rebuilt when the state changes.
+            version = self.underline_version
+            if version is None:
+                version = self.game.state.get_version()
             for t in i.get_tags():
-                word = self.words_by_tag.get(t)
-                if word is not None and not word.is_plain(self.game):
+                if self.check_clickable(t, version):
                     has_commands = True
                     break
-        cursor_name = "pointer" if has_commands else "text"
-        cursor = Gdk.Cursor.new_from_name(cursor_name, None)
-        self.set_cursor(cursor)
+
+        cursor = self.pointer_cursor if has_commands else self.text_cursor
+        if cursor is not self.current_cursor:
+            self.current_cursor = cursor
+            self.set_cursor(cursor)
 
     def on_pressed(self, click, count, click_x, click_y):
         click.set_state(Gtk.EventSequenceState.CLAIMED)